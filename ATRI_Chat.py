@@ -1,19 +1,31 @@
 import sys
 import os
-import requests
 import json
-import pygame
 import time
 import re
+import queue
+import threading
 import traceback
-from datetime import datetime
-from volcengine.ApiInfo import ApiInfo
-from volcengine.Credentials import Credentials
-from volcengine.ServiceInfo import ServiceInfo
-from volcengine.base.Service import Service
-from openai import OpenAI
-from zai import ZhipuAiClient
+import subprocess
+import shutil
+import argparse
+import atexit
+import bisect
+import heapq
+import hashlib
+import math
+import mmap
+import unicodedata
+import zlib
+import io
+import wave
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from datetime import datetime, date
 import random
+import sqlite3
 from PyQt5.QtGui import QImage
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QTextBrowser,
@@ -23,13 +35,52 @@ from PyQt5.QtWidgets import (
 from PyQt5.QtCore import Qt, pyqtSignal, QThread, QObject, QSize, QTimer, QRect
 from PyQt5.QtGui import QFont, QTextCursor, QPalette, QColor, QPainterPath, QRegion, QPixmap, QPainter, QBrush
 
-# 添加PIL库用于图像处理
-try:
-    from PIL import Image, ImageFilter
-    HAS_PIL = True
-except ImportError:
-    HAS_PIL = False
-    print("警告| 未安装PIL库，将使用纯色背景")
+# 依赖库按需加载：requests、httpx、pygame、volcengine、openai、zai、PIL、numpy和soundfile在首次使用时导入，缩短启动时间
+
+# 添加PIL库用于图像处理，首次使用时加载
+PIL_MODULES = None
+
+def import_pil():
+    """加载PIL库，未安装时返回(None, None)"""
+    global PIL_MODULES
+    if PIL_MODULES is None:
+        try:
+            from PIL import Image, ImageFilter
+            PIL_MODULES = (Image, ImageFilter)
+        except ImportError:
+            PIL_MODULES = (None, None)
+            print("警告| 未安装PIL库，将使用纯色背景")
+    return PIL_MODULES
+
+# 添加numpy库用于语义检索，首次使用时加载
+NUMPY_MODULE = None
+
+def import_numpy():
+    """加载numpy库，未安装时返回None"""
+    global NUMPY_MODULE
+    if NUMPY_MODULE is None:
+        try:
+            import numpy
+            NUMPY_MODULE = numpy
+        except ImportError:
+            NUMPY_MODULE = False
+            print("警告| 未安装numpy库，将禁用语义检索")
+    return NUMPY_MODULE or None
+
+# 添加soundfile库用于压缩保存调试录音，首次使用时加载
+SOUNDFILE_MODULE = None
+
+def import_soundfile():
+    """加载soundfile库，未安装时返回None"""
+    global SOUNDFILE_MODULE
+    if SOUNDFILE_MODULE is None:
+        try:
+            import soundfile
+            SOUNDFILE_MODULE = soundfile
+        except ImportError:
+            SOUNDFILE_MODULE = False
+            print("警告| 未安装soundfile库，调试录音将保存为WAV")
+    return SOUNDFILE_MODULE or None
 
 # 个人主观排行，文笔：GLM4.6 > deepseek思考模式 > GLM4.5；
 
@@ -40,16 +91,93 @@ except ImportError:
 
 # 配置
 MODEL = "deepseek-reasoner" # 模型
-MAX_HISTORY_MESSAGES = 30 # 最大上下文条数，后端历史条数
+CONTEXT_TOKEN_BUDGET = 32000 # 上下文Token预算，包含系统提示词、相关记忆和回复预留
+MAX_TOKENS = 8192 # 单次回复最大Token数，从上下文预算中预留
+HISTORY_EVICT_TOKENS = 4000 # 上下文超出预算时额外移除的Token数，整块移除以保持前缀缓存命中
 SHORT_TERM_MEMORY_MESSAGES = 16  # 加载短期记忆条数，启动时加载的后端历史条数
 SUMMARY_HISTORY_LENGTH = 80 # 最大对话总结条数，后端长历史条数
 MEMORY_DAYS = 7 # 加载记忆天数
+DIARY_HOT_DAYS = None # 热日记天数，更早的日记移入压缩的冷存储，回忆命中时才读取内容；首次移出前备份日记文件为.bak；设为None时不启用
+DIARY_COLD_DIR = "diary_cold" # 冷日记分片目录，位于memory_core目录下
+SHORT_TERM_MEMORY_FILE = "short_term_memory.jsonl" # 短期记忆日志，每条消息只追加写入一行
+SHORT_TERM_FSYNC_INTERVAL = 1.0 # 短期记忆后台写入时合并刷盘的间隔(秒)
+SHORT_TERM_COMPACT_LINES = 500 # 短期记忆日志超过该行数时压缩，只保留最近的消息
+LONG_TERM_MEMORY_DIR = "long_term_memory" # 长期记忆归档目录，按月分段的JSONL
 AI_AVATAR_PATH = "亚托莉.png"  # AI头像
 USER_AVATAR_PATH = "尼娅.png"  # 用户头像
 USE_TRANSLATION = True  # 是否启用翻译功能，True为启用
+USE_STREAM = True # 是否启用流式回复，True为启用
+STREAM_REPAINT_INTERVAL = 50 # 流式回复气泡刷新间隔(毫秒)
+USE_BILINGUAL_REPLY = False # 是否让AI在说话内容后用<ja>标签附带日语，直接用于TTS，跳过翻译请求；标签缺失或格式错误时回退到翻译，需要启用翻译功能，True为启用
+USE_SPEECH_PIPELINE = True # 是否启用分句流水线(翻译、TTS和播放并行)，True为启用
+PIPELINE_QUEUE_SIZE = 2 # 流水线阶段间队列长度
+MIN_SENTENCE_LENGTH = 6 # 分句最短字数，过短的句子与下一句合并
+
+# ChatAI服务商配置，按优先级排列，第一个为主服务商；未设置密钥的服务商不会启用
+CHATAI_PROVIDERS = [
+    {"name": "DeepSeek", "kind": "openai", "api_key_env": "CHATAI_API_KEY", "base_url": os.getenv("ATRI_DEEPSEEK_BASE_URL", "https://api.deepseek.com"), "model": MODEL, "max_temperature": 2.0},
+    {"name": "智谱AI", "kind": "zhipu", "api_key_env": "CHATAI_API_KEY2", "base_url": None, "model": "GLM-4.6", "max_temperature": 1.0},
+    {"name": "Qwen", "kind": "openai", "api_key_env": "CHATAI_API_KEY3", "base_url": "https://dashscope.aliyuncs.com/compatible-mode/v1", "model": "qwen3-max", "max_temperature": 1.99},
+]
+USE_HEDGED_REQUEST = False # 是否启用对冲请求：主服务商超时未出字时向下一个服务商再发一次请求，取先出字者，True为启用
+HEDGE_DELAY = 8.0 # 对冲请求前等待首字的时间(秒)
+PROVIDER_STATS_WINDOW = 50 # 服务商延迟和错误率的统计窗口(次)
+PROVIDER_MAX_ERROR_RATE = 0.5 # 错误率超过该值的服务商降低优先级
+
+# 记忆核心存储配置
+MEMORY_BACKEND = "json" # 记忆核心存储方式："json"为memory_core下的JSON文件，"sqlite"为SQLite数据库(首次启用时自动迁移JSON文件)
+MEMORY_DB_FILE = "memory_core.db" # SQLite数据库文件名，位于memory_core目录下
+
+# 会话增量总结配置
+USE_ROLLING_SUMMARY = True # 是否在上下文移出对话时后台增量总结移出的部分，以摘要形式保留在提示词中，True为启用
+ROLLING_SUMMARY_MAX_CHARS = 1200 # 会话摘要的最大字数
+
+# 相关记忆选择配置
+RECALL_BUDGET_COUNT = 5 # 每轮最多加入的相关记忆条数
+RECALL_BUDGET_TOKENS = None # 每轮相关记忆的Token预算，设为None时只按条数限制
+RECALL_SEED = None # 相关记忆排序的随机种子，设为整数时相同输入的结果可复现(用于基准测试)
+RECALL_WEIGHTS = {"match": 1.0, "recency": 0.5, "rarity": 0.5, "semantic": 2.0, "usage": -0.3, "noise": 0.2} # 打分权重：命中次数、时间远近、Essence稀有度、语义相似度、近期使用次数、随机扰动
+RECALL_RECENCY_HALF_LIFE = 30 # 时间远近得分的半衰期(天)
+RECALL_USAGE_DECAY = 0.5 # 近期使用次数每轮衰减系数
+
+# 语义检索配置
+USE_SEMANTIC_RECALL = True # 是否启用日记语义检索(字符n-gram TF-IDF，本地CPU运行)，需要numpy，True为启用
+SEMANTIC_TOP_K = 3 # 语义检索的候选记忆条数，与关键词命中的记忆一起排序
+SEMANTIC_MIN_SCORE = 0.05 # 语义检索最低余弦相似度
+SEMANTIC_DIMENSIONS = 2048 # n-gram哈希特征维度
+
+# 耗时追踪配置
+TRACE_ENABLED = True # 是否记录每轮对话各阶段耗时，True为启用
+TRACE_FILE = os.path.join("debug", "trace.jsonl") # 耗时追踪文件，每轮一行
+TRACE_PRINT_WATERFALL = True # 是否在每轮结束时打印耗时瀑布图
+
+# 启动耗时配置
+IMPORT_TIME_BUDGET = 1.5 # 模块导入耗时预算(秒)，使用`--check-import-budget`检查
+
+# 网络连接配置
+HTTP_POOL_SIZE = 4 # 每个服务的连接池大小
+HTTP_KEEPALIVE_EXPIRY = 120 # 空闲连接保持时间(秒)
+LLM_TIMEOUT = 120 # ChatAI请求超时(秒)
+TTS_TIMEOUT = (5, 120) # TTS请求超时(连接, 读取)(秒)
+
+# 翻译配置，可通过环境变量指向本地替身服务(tools/fake_services.py)
+TRANSLATE_API_HOST = os.getenv("ATRI_TRANSLATE_HOST", "translate.volcengineapi.com")
+TRANSLATE_BATCH_SIZE = 16 # 每次翻译请求最多包含的句子数
+TRANSLATE_BATCH_CHARS = 2000 # 每次翻译请求最多包含的字数
+TRANSLATE_MAX_WORKERS = 3 # 长回复分多次请求时的最大并发数
+USE_TRANSLATION_CACHE = True # 是否缓存翻译结果(按句)，True为启用
+TRANSLATION_CACHE_FILE = "translation_cache.db" # 翻译缓存数据库文件
+TRANSLATION_CACHE_MEMORY_SIZE = 1000 # 内存中缓存的条数，也是启动时预加载的条数
+TRANSLATION_CACHE_DISK_SIZE = 20000 # 磁盘中缓存的最多条数，超出时删除最久未使用的
 
 # TTS 配置
-TTS_API_URL = "http://127.0.0.1:9880/tts"
+TTS_API_URL = os.getenv("ATRI_TTS_API_URL", "http://127.0.0.1:9880/tts")
+USE_TTS_STREAMING = True # 是否启用流式TTS，边接收音频边播放，需要GPT-SoVITS的api_v2，True为启用
+TTS_JITTER_BUFFER = 0.3 # 流式TTS开始播放前缓冲的音频时长(秒)，网络或合成不稳定时调大
+TTS_STREAM_CHUNK_SIZE = 4096 # 流式TTS每次读取的字节数
+DEBUG_AUDIO_DIR = "debug" # 调试录音目录
+DEBUG_AUDIO_KEEP = 20 # 调试录音保留最近的条数，后台写入，不影响播放；设为0时不保存
+DEBUG_AUDIO_FORMAT = "wav" # 调试录音格式："wav"，或压缩保存的"flac"、"ogg"(Opus)，压缩需要soundfile库
 REF_AUDIO_CONFIG = {
     "ref_audio_path": r"D:\ATRI_Chat\ATRI_021.wav", # 参考音频，很重要
     "prompt_text": "あなた方ヒトがそのように総称する精密機械に属していますが", # 参考文本，很重要
@@ -64,6 +192,2101 @@ REF_AUDIO_CONFIG = {
     "super_sampling": True, # 超采样
 }
 
+class TurnTracer:
+    """每轮对话的耗时追踪，记录各阶段的开始和结束时间"""
+    def __init__(self, file_path=TRACE_FILE, enabled=TRACE_ENABLED):
+        self.file_path = file_path
+        self.enabled = enabled
+        self.turn = None
+        self.turn_count = 0
+        self.lock = threading.Lock()
+
+    def begin_turn(self, kind):
+        """开始新一轮追踪，未结束的上一轮直接结束"""
+        if not self.enabled:
+            return
+        self.end_turn()
+        with self.lock:
+            self.turn_count += 1
+            self.turn = {
+                "turn": self.turn_count,
+                "kind": kind,
+                "started_at": datetime.now().isoformat(timespec="seconds"),
+                "origin": time.perf_counter(),
+                "spans": [],
+                "marks": {},
+            }
+
+    def elapsed_ms(self, turn):
+        """距本轮开始的毫秒数"""
+        return round((time.perf_counter() - turn["origin"]) * 1000, 1)
+
+    def start(self, name):
+        """开始一个阶段，返回用于结束阶段的记录"""
+        turn = self.turn
+        if not self.enabled or turn is None:
+            return None
+        return {"turn": turn, "name": name, "start_ms": self.elapsed_ms(turn), "thread": threading.current_thread().name}
+
+    def end(self, span):
+        """结束一个阶段"""
+        if span is None:
+            return
+        turn = span.pop("turn")
+        span["end_ms"] = self.elapsed_ms(turn)
+        with self.lock:
+            turn["spans"].append(span)
+
+    @contextmanager
+    def span(self, name):
+        """以上下文管理器的方式追踪一个阶段"""
+        record = self.start(name)
+        try:
+            yield
+        finally:
+            self.end(record)
+
+    def mark(self, name):
+        """记录本轮第一次发生某事件的时间，如首字、首个音频"""
+        turn = self.turn
+        if not self.enabled or turn is None:
+            return
+        with self.lock:
+            if name not in turn["marks"]:
+                turn["marks"][name] = self.elapsed_ms(turn)
+
+    def end_turn(self):
+        """结束本轮追踪，写入追踪文件并打印瀑布图"""
+        with self.lock:
+            turn, self.turn = self.turn, None
+        if turn is None:
+            return
+
+        record = {
+            "turn": turn["turn"],
+            "kind": turn["kind"],
+            "started_at": turn["started_at"],
+            "total_ms": self.elapsed_ms(turn),
+            "first_token_ms": turn["marks"].get("first_token"),
+            "first_audio_ms": turn["marks"].get("first_audio"),
+            "marks": turn["marks"],
+            "spans": sorted(turn["spans"], key=lambda span: span["start_ms"]),
+        }
+
+        try:
+            os.makedirs(os.path.dirname(self.file_path) or ".", exist_ok=True)
+            with open(self.file_path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"警告| 写入耗时追踪失败: {str(e)}")
+
+        if TRACE_PRINT_WATERFALL:
+            self.print_waterfall(record)
+
+    def print_waterfall(self, record, width=40):
+        """打印耗时瀑布图"""
+        total_ms = max(record["total_ms"], 1)
+        print(f"信息| 第{record['turn']}轮({record['kind']})耗时瀑布图，总耗时 {total_ms / 1000:.2f}s")
+        for span in record["spans"]:
+            offset = int(span["start_ms"] / total_ms * width)
+            length = max(int((span["end_ms"] - span["start_ms"]) / total_ms * width), 1)
+            bar = " " * offset + "█" * length
+            print(f"      {span['name']:<16}|{bar:<{width}}| {span['start_ms'] / 1000:>6.2f}s +{(span['end_ms'] - span['start_ms']) / 1000:.2f}s")
+
+        first_token = record["first_token_ms"]
+        first_audio = record["first_audio_ms"]
+        print(
+            f"信息| 首字: {first_token / 1000:.2f}s" if first_token is not None else "信息| 首字: -",
+            f"| 首个音频: {first_audio / 1000:.2f}s" if first_audio is not None else "| 首个音频: -",
+            f"| 总耗时: {total_ms / 1000:.2f}s"
+        )
+
+class AhoCorasick:
+    """Aho-Corasick自动机，一次扫描文本找出所有出现的关键词"""
+    def __init__(self, patterns):
+        # 字典树：子节点、失败指针和每个节点匹配到的关键词
+        self.children = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+
+        for pattern in patterns:
+            self.insert(pattern)
+        self.build_fail_links()
+
+    def insert(self, pattern):
+        """插入关键词"""
+        node = 0
+        for char in pattern:
+            next_node = self.children[node].get(char)
+            if next_node is None:
+                next_node = len(self.children)
+                self.children[node][char] = next_node
+                self.children.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+            node = next_node
+        self.outputs[node].append(pattern)
+
+    def build_fail_links(self):
+        """按广度优先构建失败指针"""
+        pending = deque(self.children[0].values())
+        while pending:
+            node = pending.popleft()
+            for char, child in self.children[node].items():
+                pending.append(child)
+                fail_node = self.fail[node]
+                while fail_node and char not in self.children[fail_node]:
+                    fail_node = self.fail[fail_node]
+                fallback = self.children[fail_node].get(char, 0)
+                self.fail[child] = fallback if fallback != child else 0
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+    def find_all(self, text):
+        """返回文本中出现的所有关键词"""
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in self.children[node]:
+                node = self.fail[node]
+            node = self.children[node].get(char, 0)
+            if self.outputs[node]:
+                found.update(self.outputs[node])
+        return found
+
+class DiaryStore:
+    """按日期排序的日记存储，日期在写入时解析一次；冷日记只保存日期和Essence，内容按需读取"""
+    def __init__(self, entries=(), loader=None):
+        # 日期到日记条目的映射，冷日记条目没有"content"
+        self.entries = {}
+        # 按时间排序的(日期序号, 日期)列表
+        self.keys = []
+        # 按日期读取冷日记内容的方法
+        self.loader = loader
+
+        for entry in entries:
+            self.entries[entry["date"]] = entry
+        self.keys = sorted(self.sort_key(date) for date in self.entries)
+
+    @staticmethod
+    @lru_cache(maxsize=65536)
+    def sort_key(date):
+        """将日期解析为可排序的键，兼容旧格式；结果缓存，每个日期只解析一次"""
+        for date_format in ("%Y年%m月%d日", "%m月%d日"):
+            try:
+                # 旧格式没有年份，与strptime一致按1900年处理
+                return (datetime.strptime(date, date_format).toordinal(), date)
+            except ValueError:
+                continue
+        # 无法解析的日期排在最前
+        return (0, date)
+
+    @classmethod
+    def is_old(cls, date, hot_days):
+        """日期是否早于热日记范围，没有年份或无法解析的日期始终视为热日记"""
+        ordinal = cls.sort_key(date)[0]
+        return "年" in date and 0 < ordinal < datetime.now().toordinal() - hot_days
+
+    def upsert(self, entry):
+        """新增或覆盖同一日期的日记"""
+        date = entry["date"]
+        if date not in self.entries:
+            bisect.insort(self.keys, self.sort_key(date))
+        self.entries[date] = entry
+
+    def get(self, date):
+        """按日期获取日记，冷日记读取内容后返回，不常驻内存"""
+        entry = self.entries.get(date)
+        if entry is not None and "content" not in entry:
+            entry = dict(entry, content=self.loader(date))
+        return entry
+
+    def latest(self, days):
+        """获取最新的几天日记，最新的在前面"""
+        if days <= 0:
+            return []
+        return [self.get(date) for _, date in reversed(self.keys[-days:])]
+
+    def latest_dates(self, days):
+        """获取最新几天日记的日期，不读取内容"""
+        if days <= 0:
+            return []
+        return [date for _, date in self.keys[-days:]]
+
+    def to_list(self):
+        """按时间顺序转换为列表，冷日记不含内容"""
+        return [self.entries[date] for _, date in self.keys]
+
+    def hot_entries(self):
+        """按时间顺序获取内容在内存中的日记"""
+        return [entry for entry in self.to_list() if "content" in entry]
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __len__(self):
+        return len(self.keys)
+
+class ColdDiaryArchive:
+    """冷日记存储：按月分片，每条日记单独zlib压缩，内存映射读取；内存中只保留日期、Essence和偏移"""
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.jsonl")
+        # 日期到(分片, 偏移, 长度)和Essence的映射
+        self.locations = {}
+        self.essences = {}
+        # 分片到(文件, 内存映射)的缓存
+        self.maps = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        """读取索引，返回冷日记条目(只含日期和Essence)"""
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 写入中断的最后一行直接跳过
+                        continue
+                    # 同一日期以最后一次写入为准
+                    self.locations[record["date"]] = (record["shard"], record["offset"], record["length"])
+                    self.essences[record["date"]] = record["essences"]
+        return [{"date": date, "essences": essences} for date, essences in self.essences.items()]
+
+    @staticmethod
+    def shard_name(date):
+        """日记所属的月份分片"""
+        ordinal = DiaryStore.sort_key(date)[0]
+        return datetime.fromordinal(ordinal).strftime("%Y-%m") if ordinal > 0 else "unknown"
+
+    def add(self, entries):
+        """将日记写入对应的月份分片，先写数据再写索引"""
+        shards = {}
+        for entry in entries:
+            shards.setdefault(self.shard_name(entry["date"]), []).append(entry)
+
+        records = []
+        with self.lock:
+            for shard, shard_entries in shards.items():
+                # 追加前关闭该分片的内存映射
+                self.close_map(shard)
+                with open(os.path.join(self.directory, f"{shard}.zlib"), "ab") as file:
+                    for entry in shard_entries:
+                        data = zlib.compress(json.dumps(entry, ensure_ascii=False).encode("utf-8"))
+                        records.append({"date": entry["date"], "essences": entry.get("essences", []), "shard": shard, "offset": file.tell(), "length": len(data)})
+                        file.write(data)
+                    file.flush()
+                    os.fsync(file.fileno())
+
+            with open(self.index_path, "a", encoding="utf-8") as file:
+                file.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+            for record in records:
+                self.locations[record["date"]] = (record["shard"], record["offset"], record["length"])
+                self.essences[record["date"]] = record["essences"]
+
+    def read(self, date):
+        """读取冷日记内容"""
+        shard, offset, length = self.locations[date]
+        with self.lock:
+            if shard not in self.maps:
+                file = open(os.path.join(self.directory, f"{shard}.zlib"), "rb")
+                self.maps[shard] = (file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+            data = self.maps[shard][1][offset:offset + length]
+        return json.loads(zlib.decompress(data))["content"]
+
+    def close_map(self, shard):
+        """关闭分片的内存映射"""
+        file_map = self.maps.pop(shard, None)
+        if file_map is not None:
+            file_map[1].close()
+            file_map[0].close()
+
+class EssenceIndex:
+    """日记Essence索引，关键词到日记日期的倒排表加Aho-Corasick自动机"""
+    def __init__(self, diary=()):
+        # 日期到Essence列表和日记顺序的映射
+        self.entry_essences = {}
+        self.entry_order = {}
+        # 小写关键词到日期集合的倒排表
+        self.postings = {}
+        self.automaton = None
+
+        for entry in diary:
+            self.upsert(entry)
+
+    def upsert(self, entry):
+        """新增或更新一条日记的索引"""
+        date = entry["date"]
+        self.remove(date, keep_order=True)
+
+        essences = [essence for essence in entry.get("essences", []) if essence]
+        self.entry_essences[date] = essences
+        if date not in self.entry_order:
+            self.entry_order[date] = DiaryStore.sort_key(date)
+
+        for essence in essences:
+            key = essence.lower()
+            if key not in self.postings:
+                self.postings[key] = set()
+                # 出现新关键词时，下次匹配前重建自动机
+                self.automaton = None
+            self.postings[key].add(date)
+
+    def remove(self, date, keep_order=False):
+        """移除一条日记的索引"""
+        for essence in self.entry_essences.pop(date, []):
+            dates = self.postings.get(essence.lower())
+            if dates is not None:
+                dates.discard(date)
+        if not keep_order:
+            self.entry_order.pop(date, None)
+
+    def rarity(self, essence):
+        """Essence稀有度，出现的日记越少越接近1"""
+        total = len(self.entry_essences)
+        frequency = len(self.postings.get(essence.lower(), ()))
+        if total == 0 or frequency == 0:
+            return 0.0
+        return math.log1p(total / frequency) / math.log1p(total)
+
+    def match(self, text):
+        """一次扫描文本，返回按日记顺序排列的(日期, 匹配的Essence)"""
+        if self.automaton is None:
+            self.automaton = AhoCorasick(self.postings.keys())
+        found = self.automaton.find_all(text.lower())
+        if not found:
+            return []
+
+        candidate_dates = set()
+        for key in found:
+            candidate_dates.update(self.postings.get(key, ()))
+
+        matches = []
+        for date in sorted(candidate_dates, key=self.entry_order.get):
+            # 每个日记条目只匹配一次，取条目中第一个出现的Essence
+            for essence in self.entry_essences[date]:
+                if essence.lower() in found:
+                    matches.append((date, essence))
+                    break
+        return matches
+
+class SemanticIndex:
+    """日记语义检索索引，字符n-gram哈希TF-IDF稀疏向量加倒排表余弦相似度"""
+    VERSION = 1
+
+    def __init__(self, path, dimensions=SEMANTIC_DIMENSIONS):
+        self.np = import_numpy()
+        self.path = path
+        self.dimensions = dimensions
+        # 行号到日期、日期到行号和日期到内容指纹的映射
+        self.dates = []
+        self.rows = {}
+        self.fingerprints = {}
+        # 每行的稀疏向量：非零哈希桶和n-gram次数
+        self.row_buckets = []
+        self.row_counts = []
+        self.df = self.np.zeros(dimensions, dtype=self.np.int32)
+        # 按哈希桶排列的倒排表和加权行范数，日记变化后重新构建
+        self.postings = None
+        self.dirty = False
+
+    @staticmethod
+    def entry_text(entry):
+        """日记参与检索的文本，内容加Essence"""
+        return entry.get("content", "") + " " + " ".join(entry.get("essences", []))
+
+    def ngram_counts(self, text):
+        """统计文本的双字n-gram，返回哈希桶到次数的映射"""
+        text = re.sub(r"[\W_]+", "", unicodedata.normalize("NFKC", text).lower())
+        counts = {}
+        grams = [text[i:i + 2] for i in range(len(text) - 1)] or list(text)
+        for gram in grams:
+            # crc32在不同进程间保持一致，保证磁盘索引可复用
+            bucket = zlib.crc32(gram.encode("utf-8")) % self.dimensions
+            counts[bucket] = counts.get(bucket, 0) + 1
+        return counts
+
+    def vectorize(self, text):
+        """文本转为稀疏向量(哈希桶, 次数)"""
+        np = self.np
+        counts = self.ngram_counts(text)
+        buckets = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.uint16, count=len(counts))
+        return buckets, values
+
+    def upsert(self, date, text):
+        """新增或更新一天的日记，内容未变化时跳过"""
+        fingerprint = zlib.crc32(text.encode("utf-8"))
+        if self.fingerprints.get(date) == fingerprint:
+            return False
+        buckets, counts = self.vectorize(text)
+        self.set_row(date, buckets, counts, fingerprint)
+        return True
+
+    def set_row(self, date, buckets, counts, fingerprint):
+        """写入一行稀疏向量，同时更新文档频率"""
+        row = self.rows.get(date)
+        if row is None:
+            row = len(self.dates)
+            self.dates.append(date)
+            self.row_buckets.append(buckets)
+            self.row_counts.append(counts)
+            self.rows[date] = row
+        else:
+            self.df[self.row_buckets[row]] -= 1
+            self.row_buckets[row] = buckets
+            self.row_counts[row] = counts
+        # 同一行的哈希桶不重复，可以直接按下标累加
+        self.df[buckets] += 1
+        self.fingerprints[date] = fingerprint
+        self.postings = None
+        self.dirty = True
+
+    def remove(self, date):
+        """删除一天的日记，最后一行移到空出的位置"""
+        row = self.rows.pop(date, None)
+        if row is None:
+            return
+        self.fingerprints.pop(date, None)
+        self.df[self.row_buckets[row]] -= 1
+        last = len(self.dates) - 1
+        if row != last:
+            self.dates[row] = self.dates[last]
+            self.row_buckets[row] = self.row_buckets[last]
+            self.row_counts[row] = self.row_counts[last]
+            self.rows[self.dates[row]] = row
+        self.dates.pop()
+        self.row_buckets.pop()
+        self.row_counts.pop()
+        self.postings = None
+        self.dirty = True
+
+    def sync(self, diary):
+        """与日记同步，只重新计算新增或修改的日记"""
+        dates = set()
+        for entry in diary:
+            dates.add(entry["date"])
+            if "content" not in entry:
+                # 冷日记不再变化，已有索引时不读取内容；首次索引时内容只临时读取，索引中只保留n-gram次数
+                if entry["date"] in self.rows:
+                    continue
+                entry = diary.get(entry["date"])
+            self.upsert(entry["date"], self.entry_text(entry))
+        for date in [date for date in self.dates if date not in dates]:
+            self.remove(date)
+
+    def build_postings(self):
+        """构建倒排表：按哈希桶排序的(行号, 次线性词频)，以及加权行范数"""
+        np = self.np
+        size = len(self.dates)
+        lengths = np.fromiter((len(buckets) for buckets in self.row_buckets), dtype=np.int64, count=size)
+        rows = np.repeat(np.arange(size, dtype=np.int32), lengths)
+        buckets = np.concatenate(self.row_buckets) if size else np.zeros(0, dtype=np.int32)
+        weights = 1.0 + np.log(np.concatenate(self.row_counts).astype(np.float32)) if size else np.zeros(0, dtype=np.float32)
+
+        idf = (np.log((size + 1) / (self.df + 1)) + 1).astype(np.float32)
+        norms = np.sqrt(np.bincount(rows, weights=(weights * idf[buckets]) ** 2, minlength=size))
+
+        order = np.argsort(buckets, kind="stable")
+        bucket_ptr = np.zeros(self.dimensions + 1, dtype=np.int64)
+        np.cumsum(np.bincount(buckets, minlength=self.dimensions), out=bucket_ptr[1:])
+        self.postings = (bucket_ptr, rows[order], weights[order], idf, norms)
+
+    def search(self, text, top_k=SEMANTIC_TOP_K, min_score=SEMANTIC_MIN_SCORE, exclude=()):
+        """返回与文本最相似的日记[(日期, 相似度)]，按相似度从高到低"""
+        np = self.np
+        size = len(self.dates)
+        counts = self.ngram_counts(text) if isinstance(text, str) else {}
+        if size == 0 or not counts or top_k <= 0:
+            return []
+
+        if self.postings is None:
+            self.build_postings()
+        bucket_ptr, posting_rows, posting_weights, idf, norms = self.postings
+
+        # 只遍历查询n-gram对应的倒排表，按行累加点积
+        buckets = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        weights = (1.0 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))) * idf[buckets]
+        query_norm = float(np.sqrt(weights @ weights))
+        rows = [posting_rows[bucket_ptr[bucket]:bucket_ptr[bucket + 1]] for bucket in buckets]
+        products = [posting_weights[bucket_ptr[bucket]:bucket_ptr[bucket + 1]] * (weight * idf[bucket]) for bucket, weight in zip(buckets, weights)]
+        dots = np.bincount(np.concatenate(rows), weights=np.concatenate(products), minlength=size)
+        scores = dots / (norms * query_norm + 1e-9)
+
+        for date in exclude:
+            row = self.rows.get(date)
+            if row is not None:
+                scores[row] = -1.0
+
+        k = min(top_k, size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.dates[row], float(scores[row])) for row in top if scores[row] >= min_score]
+
+    def load(self):
+        """从磁盘加载索引，格式或维度不一致时忽略"""
+        np = self.np
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if int(data["version"]) != self.VERSION or int(data["dimensions"]) != self.dimensions:
+                    print("提示| 语义索引格式已变化，将重新构建")
+                    return
+                # 稀疏存储：每行的非零列号和n-gram次数
+                indptr, indices, counts = data["indptr"], data["indices"], data["counts"]
+                dates, fingerprints = data["dates"].tolist(), data["fingerprints"].tolist()
+        except Exception as e:
+            print(f"警告| 加载语义索引失败，将重新构建: {str(e)}")
+            return
+
+        # 按行切分为稀疏向量，不还原为稠密矩阵
+        indices = indices.astype(np.int32)
+        self.row_buckets = np.split(indices, indptr[1:-1])
+        self.row_counts = np.split(counts.astype(np.uint16), indptr[1:-1])
+        self.df = np.bincount(indices, minlength=self.dimensions).astype(np.int32)
+        self.dates = dates
+        self.rows = {date: row for row, date in enumerate(dates)}
+        self.fingerprints = dict(zip(dates, fingerprints))
+        self.postings = None
+        self.dirty = False
+
+    def save(self):
+        """有变化时将索引写入磁盘，先写临时文件再替换"""
+        np = self.np
+        if not self.dirty:
+            return
+        size = len(self.dates)
+        indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum([len(buckets) for buckets in self.row_buckets], out=indptr[1:])
+        indices = np.concatenate(self.row_buckets) if size else np.zeros(0, dtype=np.int32)
+        counts = np.concatenate(self.row_counts) if size else np.zeros(0, dtype=np.uint16)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as file:
+            np.savez(
+                file,
+                version=self.VERSION,
+                dimensions=self.dimensions,
+                dates=np.array(self.dates, dtype=str),
+                fingerprints=np.array([self.fingerprints[date] for date in self.dates], dtype=np.uint32),
+                indptr=indptr,
+                indices=indices.astype(np.uint32),
+                counts=counts.astype(np.uint16),
+            )
+        os.replace(temp_path, self.path)
+        self.dirty = False
+
+class SQLiteMemoryStore:
+    """SQLite记忆核心存储，WAL模式加事务写入，日记内容建立FTS5全文索引"""
+    # 列表类记忆，每项按位置存一行
+    LIST_TABLES = ("promise", "plan", "preference", "motivation", "pivotal_memory")
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # 工作线程和启动线程都会访问，由锁保证串行
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.use_fts = False
+        self.create_tables()
+
+    def create_tables(self):
+        """创建表、全文索引和同步触发器"""
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS diary (id INTEGER PRIMARY KEY, date TEXT UNIQUE NOT NULL, content TEXT NOT NULL, essences TEXT NOT NULL)")
+            for table in self.LIST_TABLES:
+                # 每项以JSON存储，兼容字符串和字典
+                self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (position INTEGER PRIMARY KEY, item TEXT NOT NULL)")
+
+        try:
+            with self.conn:
+                # trigram分词支持中文子串检索，旧版SQLite退回默认分词
+                try:
+                    self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS diary_fts USING fts5(content, content='diary', content_rowid='id', tokenize='trigram')")
+                except sqlite3.OperationalError:
+                    self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS diary_fts USING fts5(content, content='diary', content_rowid='id')")
+                self.conn.execute("CREATE TRIGGER IF NOT EXISTS diary_ai AFTER INSERT ON diary BEGIN INSERT INTO diary_fts(rowid, content) VALUES (new.id, new.content); END")
+                self.conn.execute("CREATE TRIGGER IF NOT EXISTS diary_ad AFTER DELETE ON diary BEGIN INSERT INTO diary_fts(diary_fts, rowid, content) VALUES ('delete', old.id, old.content); END")
+                self.conn.execute("CREATE TRIGGER IF NOT EXISTS diary_au AFTER UPDATE ON diary BEGIN INSERT INTO diary_fts(diary_fts, rowid, content) VALUES ('delete', old.id, old.content); INSERT INTO diary_fts(rowid, content) VALUES (new.id, new.content); END")
+            self.use_fts = True
+        except sqlite3.OperationalError as e:
+            print(f"警告| 当前SQLite不支持FTS5，将禁用日记全文检索: {str(e)}")
+
+    def load(self, hot_days=None):
+        """读取全部记忆，返回顺序与`加载记忆核心`一致；早于热日记范围的日记不读取内容"""
+        with self.lock:
+            diary = [
+                {"date": date, "essences": json.loads(essences)}
+                for date, essences in self.conn.execute("SELECT date, essences FROM diary")
+            ]
+            hot_dates = [entry["date"] for entry in diary if hot_days is None or not DiaryStore.is_old(entry["date"], hot_days)]
+            contents = {}
+            for start in range(0, len(hot_dates), 500):
+                chunk = hot_dates[start:start + 500]
+                contents.update(self.conn.execute(f"SELECT date, content FROM diary WHERE date IN ({','.join('?' * len(chunk))})", chunk))
+            for entry in diary:
+                if entry["date"] in contents:
+                    entry["content"] = contents[entry["date"]]
+            lists = {
+                table: [json.loads(item) for (item,) in self.conn.execute(f"SELECT item FROM {table} ORDER BY position")]
+                for table in self.LIST_TABLES
+            }
+        return diary, lists["promise"], lists["plan"], lists["preference"], lists["motivation"], lists["pivotal_memory"]
+
+    def save(self, summary_data):
+        """在一个事务中写入总结结果，日记按日期覆盖，列表只写入变化的行"""
+        with self.lock, self.conn:
+            if "diary" in summary_data:
+                self.conn.executemany(
+                    "INSERT INTO diary (date, content, essences) VALUES (?, ?, ?) "
+                    "ON CONFLICT(date) DO UPDATE SET content = excluded.content, essences = excluded.essences "
+                    "WHERE content != excluded.content OR essences != excluded.essences",
+                    [(entry["date"], entry.get("content", ""), json.dumps(entry.get("essences", []), ensure_ascii=False)) for entry in summary_data["diary"]]
+                )
+            for table in self.LIST_TABLES:
+                if table in summary_data:
+                    self.replace_list(table, summary_data[table])
+
+    def replace_list(self, table, items):
+        """用新列表覆盖旧列表，只更新有变化的位置"""
+        old_items = dict(self.conn.execute(f"SELECT position, item FROM {table}"))
+        new_items = {position: json.dumps(item, ensure_ascii=False) for position, item in enumerate(items)}
+        changed = [(position, item) for position, item in new_items.items() if old_items.get(position) != item]
+        self.conn.executemany(f"INSERT OR REPLACE INTO {table} (position, item) VALUES (?, ?)", changed)
+        self.conn.execute(f"DELETE FROM {table} WHERE position >= ?", (len(new_items),))
+
+    def read_diary_content(self, date):
+        """按日期读取日记内容"""
+        with self.lock:
+            row = self.conn.execute("SELECT content FROM diary WHERE date = ?", (date,)).fetchone()
+        return row[0] if row else ""
+
+    def search_diary(self, query, limit=5):
+        """全文检索日记内容，返回[(日期, 内容)]，按相关度排序"""
+        if not self.use_fts or not query:
+            return []
+        with self.lock:
+            # trigram索引无法检索三个字以下的词，退回子串扫描
+            if len(query) < 3:
+                return self.conn.execute(
+                    "SELECT date, content FROM diary WHERE instr(content, ?) > 0 ORDER BY id DESC LIMIT ?",
+                    (query, limit)
+                ).fetchall()
+            # 作为短语检索，避免用户输入被解析为FTS语法
+            phrase = '"' + query.replace('"', '""') + '"'
+            return self.conn.execute(
+                "SELECT diary.date, diary.content FROM diary_fts JOIN diary ON diary.id = diary_fts.rowid "
+                "WHERE diary_fts MATCH ? ORDER BY rank LIMIT ?",
+                (phrase, limit)
+            ).fetchall()
+
+    def is_migrated(self):
+        """是否已从JSON文件迁移"""
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_from_json'").fetchone() is not None
+
+    def migrate_from_json(self, memory_core_dir):
+        """一次性从memory_core下的JSON文件迁移，原文件保留作为备份"""
+        summary_data = {}
+        for name in ("diary",) + self.LIST_TABLES:
+            path = os.path.join(memory_core_dir, f"memory_core_{name}.json")
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as file:
+                    summary_data[name] = json.load(file)
+
+        # 冷存储中的日记一并迁移，日记文件中的同一日期在后覆盖
+        cold_dir = os.path.join(memory_core_dir, DIARY_COLD_DIR)
+        if os.path.exists(os.path.join(cold_dir, "index.jsonl")):
+            cold_diary = ColdDiaryArchive(cold_dir)
+            cold_entries = [dict(entry, content=cold_diary.read(entry["date"])) for entry in cold_diary.load()]
+            for shard in list(cold_diary.maps):
+                cold_diary.close_map(shard)
+            summary_data["diary"] = cold_entries + summary_data.get("diary", [])
+        self.save(summary_data)
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_json', ?)", (datetime.now().isoformat(),))
+        print(f"信息| 记忆核心已从JSON迁移到SQLite: {', '.join(summary_data) or '无记忆文件'}")
+
+    def close(self):
+        """关闭数据库连接"""
+        with self.lock:
+            self.conn.close()
+
+def message_id(message, salt=""):
+    """计算消息ID：角色和内容的哈希，新消息以创建时间作为盐，创建后不再变化"""
+    text = f"{message.get('role')}\0{message.get('content')}\0{message.get('timestamp', '')}\0{salt}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+def assign_message_id(message):
+    """为新消息分配ID，已有ID时保持不变"""
+    if "id" not in message:
+        message["id"] = message_id(message, time.time_ns())
+    return message["id"]
+
+class ShortTermMemoryLog:
+    """短期记忆日志，只追加的JSONL，由后台线程合并写入并刷盘"""
+    # 日志记录的消息字段，不包含Token估算等运行时字段
+    MESSAGE_KEYS = ("role", "content", "timestamp", "id")
+
+    def __init__(self, path, keep=SHORT_TERM_MEMORY_MESSAGES * 2):
+        self.path = path
+        self.keep = keep
+        self.lock = threading.Lock()
+        # 最近的消息副本，用于编辑、删除和压缩
+        self.tail_messages = deque(maxlen=keep)
+        self.next_seq = 0
+        # 日志行数和启动时读取到的位置
+        self.line_count = 0
+        self.scan_position = 0
+        self.queue = queue.Queue()
+        self.writer = None
+
+    def start(self):
+        """启动后台写入线程"""
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def load(self):
+        """从文件末尾向前读取，返回最近的消息"""
+        if not os.path.exists(self.path):
+            return []
+        added, edits, dropped = [], {}, set()
+        max_seq = -1
+        for line in self.read_lines_reversed():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 写入中断的最后一行直接跳过
+                continue
+            seq = record["seq"]
+            max_seq = max(max_seq, seq)
+            if record["op"] == "drop":
+                dropped.add(seq)
+            elif record["op"] == "edit":
+                # 从后往前读，最先读到的编辑是最新的
+                edits.setdefault(seq, record["content"])
+            elif seq not in dropped:
+                message = record["msg"]
+                if seq in edits:
+                    message["content"] = edits[seq]
+                message["seq"] = seq
+                # 旧日志中的消息没有ID，使用与长期记忆迁移一致的ID
+                message.setdefault("id", message_id(message))
+                added.append(message)
+                if len(added) >= self.keep:
+                    break
+
+        # 提前停止读取时，按已读部分估算总行数，用于决定何时压缩
+        file_size = os.path.getsize(self.path)
+        if self.scan_position > 0:
+            self.line_count = self.line_count * file_size // max(1, file_size - self.scan_position)
+
+        added.reverse()
+        with self.lock:
+            self.tail_messages.extend(dict(message) for message in added)
+            self.next_seq = max_seq + 1
+        return added
+
+    def read_lines_reversed(self, block_size=65536):
+        """按块从文件末尾向前逐行读取"""
+        with open(self.path, "rb") as file:
+            file.seek(0, os.SEEK_END)
+            position = file.tell()
+            remainder = b""
+            while position > 0:
+                read_size = min(block_size, position)
+                position -= read_size
+                file.seek(position)
+                self.scan_position = position
+                lines = (file.read(read_size) + remainder).split(b"\n")
+                # 第一行可能不完整，留到下一块拼接
+                remainder = lines.pop(0)
+                self.line_count += len(lines)
+                for line in reversed(lines):
+                    if line.strip():
+                        yield line.decode("utf-8")
+            if remainder.strip():
+                self.line_count += 1
+                yield remainder.decode("utf-8")
+
+    def append_new(self, messages):
+        """追加还未写入日志的消息，从末尾向前查找，遇到已写入的消息即停止"""
+        new_messages = []
+        for message in reversed(messages):
+            if "seq" in message:
+                break
+            if message.get("role") != "system":
+                new_messages.append(message)
+        for message in reversed(new_messages):
+            self.append(message)
+
+    def append(self, message):
+        """追加一条消息并分配序号"""
+        with self.lock:
+            message["seq"] = self.next_seq
+            self.next_seq += 1
+            assign_message_id(message)
+            stored = {key: message[key] for key in self.MESSAGE_KEYS if key in message}
+            self.tail_messages.append(dict(stored, seq=message["seq"]))
+            self.write({"op": "add", "seq": message["seq"], "msg": stored})
+
+    def edit(self, message):
+        """记录消息内容的修改"""
+        if "seq" not in message:
+            return
+        with self.lock:
+            for stored in self.tail_messages:
+                if stored["seq"] == message["seq"]:
+                    stored["content"] = message["content"]
+            self.write({"op": "edit", "seq": message["seq"], "content": message["content"]})
+
+    def drop(self, message):
+        """记录消息的删除"""
+        if "seq" not in message:
+            return
+        with self.lock:
+            remaining = [stored for stored in self.tail_messages if stored["seq"] != message["seq"]]
+            self.tail_messages.clear()
+            self.tail_messages.extend(remaining)
+            self.write({"op": "drop", "seq": message["seq"]})
+
+    def tail(self, count):
+        """获取最近的几条消息副本"""
+        with self.lock:
+            return list(self.tail_messages)[-count:]
+
+    def write(self, record):
+        """交给后台线程写入，超过行数时附带一次压缩"""
+        self.queue.put(json.dumps(record, ensure_ascii=False) + "\n")
+        self.line_count += 1
+        if self.line_count > max(SHORT_TERM_COMPACT_LINES, self.keep * 2):
+            lines = [
+                json.dumps({"op": "add", "seq": stored["seq"], "msg": {key: stored[key] for key in self.MESSAGE_KEYS if key in stored}}, ensure_ascii=False) + "\n"
+                for stored in self.tail_messages
+            ]
+            self.queue.put(lines)
+            self.line_count = len(lines)
+
+    def write_loop(self):
+        """后台写入：合并一段时间内的记录，每批只刷盘一次"""
+        file = open(self.path, "a", encoding="utf-8")
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + SHORT_TERM_FSYNC_INTERVAL
+            while batch[-1] is not None:
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                for item in batch:
+                    if item is None:
+                        running = False
+                    elif isinstance(item, list):
+                        # 压缩：写入临时文件后替换，只保留最近的消息
+                        file.close()
+                        file = self.compact(item)
+                        print(f"信息| 短期记忆日志已压缩，保留{len(item)}条消息")
+                    else:
+                        file.write(item)
+                file.flush()
+                os.fsync(file.fileno())
+            except Exception as e:
+                print(f"警告| 写入短期记忆失败: {str(e)}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+        file.close()
+
+    def compact(self, lines):
+        """将日志重写为最近的消息，返回新的追加句柄"""
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as temp_file:
+            temp_file.writelines(lines)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, self.path)
+        return open(self.path, "a", encoding="utf-8")
+
+    def migrate_from_json(self, json_path):
+        """一次性迁移旧的short_term_memory.json，原文件改名为.bak"""
+        with open(json_path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        messages = [msg for msg in data if msg.get("role") != "system"][-self.keep:]
+        lines = []
+        for seq, message in enumerate(messages):
+            stored = {key: message[key] for key in self.MESSAGE_KEYS if key in message}
+            lines.append(json.dumps({"op": "add", "seq": seq, "msg": stored}, ensure_ascii=False) + "\n")
+        self.compact(lines).close()
+        os.replace(json_path, json_path + ".bak")
+        print(f"信息| 短期记忆已迁移到{self.path}，共{len(lines)}条消息")
+
+    def flush(self):
+        """等待已提交的记录全部写入"""
+        if self.writer is not None:
+            self.queue.join()
+
+    def close(self):
+        """写入剩余记录并停止后台线程"""
+        if self.writer is not None and self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join()
+
+class LongTermArchive:
+    """长期记忆归档，按月分段的只追加JSONL，以消息ID加内容哈希去重，消息修改后追加新版本"""
+    MESSAGE_KEYS = ("role", "content", "timestamp", "id")
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.txt")
+        # 已归档的"消息ID:内容哈希"，首次保存时加载
+        self.ids = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def record_key(stored):
+        """归档去重键：消息ID加内容哈希，同一消息修改后(如追加时间信息)视为新记录"""
+        digest = hashlib.sha1(json.dumps(stored, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+        return f"{stored['id']}:{digest}"
+
+    def segment_path(self, month):
+        """月份分段文件路径"""
+        return os.path.join(self.directory, f"{month}.jsonl")
+
+    def load_index(self):
+        """加载去重索引，索引缺失或为只有消息ID的旧格式时扫描所有分段重建"""
+        os.makedirs(self.directory, exist_ok=True)
+        self.ids = set()
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as file:
+                self.ids.update(line.strip() for line in file if line.strip())
+            if all(":" in key for key in self.ids):
+                return
+            self.ids = set()
+
+        for filename in sorted(os.listdir(self.directory)):
+            if filename.endswith(".jsonl"):
+                with open(os.path.join(self.directory, filename), "r", encoding="utf-8") as file:
+                    for line in file:
+                        try:
+                            self.ids.add(self.record_key(json.loads(line)))
+                        except (ValueError, KeyError):
+                            continue
+        with open(self.index_path, "w", encoding="utf-8") as file:
+            file.writelines(f"{message_id}\n" for message_id in sorted(self.ids))
+        if self.ids:
+            print(f"信息| 已从分段重建长期记忆索引，共{len(self.ids)}条消息")
+
+    def append_new(self, messages):
+        """追加还未归档的消息，返回新增条数"""
+        with self.lock:
+            if self.ids is None:
+                self.load_index()
+
+            new_messages = []
+            new_keys = []
+            for message in messages:
+                if message.get("role") == "system":
+                    continue
+                assign_message_id(message)
+                stored = {key: message[key] for key in self.MESSAGE_KEYS if key in message}
+                key = self.record_key(stored)
+                if key in self.ids or key in new_keys:
+                    continue
+                new_messages.append(stored)
+                new_keys.append(key)
+            if not new_messages:
+                return 0
+
+            # 先写分段再写索引，中断时最多重复写入，不会丢失消息
+            self.write_segment(datetime.now().strftime("%Y-%m"), new_messages)
+            with open(self.index_path, "a", encoding="utf-8") as file:
+                file.writelines(f"{key}\n" for key in new_keys)
+            self.ids.update(new_keys)
+            return len(new_messages)
+
+    def write_segment(self, month, messages):
+        """追加消息到月份分段"""
+        with open(self.segment_path(month), "a", encoding="utf-8") as file:
+            file.writelines(json.dumps(message, ensure_ascii=False) + "\n" for message in messages)
+
+    def migrate_from_json(self, json_path):
+        """一次性迁移旧的long_term_memory.json，原文件改名为.bak"""
+        with open(json_path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        # 旧消息没有时间信息，归入文件最后修改的月份
+        month = datetime.fromtimestamp(os.path.getmtime(json_path)).strftime("%Y-%m")
+
+        with self.lock:
+            if self.ids is None:
+                self.load_index()
+            occurrences = {}
+            messages = []
+            for message in data:
+                if message.get("role") == "system":
+                    continue
+                # 重复出现的相同消息以出现次数区分，第一次出现与短期记忆中的旧消息ID一致
+                legacy_id = message_id(message)
+                count = occurrences.get(legacy_id, 0)
+                occurrences[legacy_id] = count + 1
+                stored = {key: message[key] for key in self.MESSAGE_KEYS if key in message}
+                stored["id"] = message.get("id") or (legacy_id if count == 0 else message_id(message, f"#{count}"))
+                key = self.record_key(stored)
+                if key not in self.ids:
+                    messages.append(stored)
+                    self.ids.add(key)
+            if messages:
+                self.write_segment(month, messages)
+                with open(self.index_path, "a", encoding="utf-8") as file:
+                    file.writelines(f"{self.record_key(message)}\n" for message in messages)
+        os.replace(json_path, json_path + ".bak")
+        print(f"信息| 长期记忆已迁移到{self.directory}，共{len(messages)}条消息")
+
+class MemoryRanker:
+    """相关记忆排序器，按命中次数、时间远近、Essence稀有度、语义相似度和近期使用次数一次性打分；可替换为同接口的其他排序器"""
+    FEATURES = ("match", "recency", "rarity", "semantic", "usage", "noise")
+
+    def __init__(self, weights=None, seed=RECALL_SEED, half_life=RECALL_RECENCY_HALF_LIFE, usage_decay=RECALL_USAGE_DECAY):
+        weights = weights or RECALL_WEIGHTS
+        self.weights = [weights.get(name, 0.0) for name in self.FEATURES]
+        self.seed = seed
+        self.half_life = half_life
+        self.usage_decay = usage_decay
+        # 未设置种子时使用共享的随机数生成器
+        self.rng = random.Random(seed)
+        # 日期到衰减后使用次数的映射
+        self.usage = {}
+
+    def columns(self, candidates, rng):
+        """按特征取出候选记忆的各列，时间远近在打分时计算"""
+        return (
+            [candidate.get("match", 0.0) for candidate in candidates],
+            [DiaryStore.sort_key(candidate["date"])[0] for candidate in candidates],
+            [candidate.get("rarity", 0.0) for candidate in candidates],
+            [candidate.get("semantic", 0.0) for candidate in candidates],
+            [self.usage.get(candidate["date"], 0.0) for candidate in candidates],
+            [rng.random() for _ in candidates],
+        )
+
+    def rank(self, candidates, limit):
+        """返回得分最高的limit条候选，按得分从高到低；设置种子时相同输入结果相同"""
+        if not candidates or limit <= 0:
+            return []
+        rng = random.Random(self.seed) if self.seed is not None else self.rng
+        match, ordinals, rarity, semantic, usage, noise = self.columns(candidates, rng)
+        today = datetime.now().toordinal()
+        limit = min(limit, len(candidates))
+
+        np = import_numpy()
+        if np is not None:
+            recency = 0.5 ** (np.maximum(0, today - np.asarray(ordinals, dtype=np.float64)) / self.half_life)
+            features = np.array([match, recency, rarity, semantic, usage, noise], dtype=np.float64)
+            scores = np.asarray(self.weights) @ features
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            # 得分相同时保持候选顺序，结果确定
+            top = top[np.lexsort((top, -scores[top]))]
+            return [candidates[i] for i in top.tolist()]
+
+        recency = [0.5 ** (max(0, today - ordinal) / self.half_life) for ordinal in ordinals]
+        scores = [
+            sum(weight * value for weight, value in zip(self.weights, row))
+            for row in zip(match, recency, rarity, semantic, usage, noise)
+        ]
+        top = heapq.nsmallest(limit, range(len(candidates)), key=lambda i: (-scores[i], i))
+        return [candidates[i] for i in top]
+
+    def record_usage(self, dates):
+        """记录本轮使用的记忆，旧的使用次数逐轮衰减"""
+        for date in list(self.usage):
+            self.usage[date] *= self.usage_decay
+            if self.usage[date] < 0.01:
+                del self.usage[date]
+        for date in dates:
+            self.usage[date] = self.usage.get(date, 0.0) + 1.0
+
+class TranslationCache:
+    """翻译缓存，内存LRU加SQLite键值存储，键为规范化原文和目标语言"""
+    def __init__(self, path, memory_size=TRANSLATION_CACHE_MEMORY_SIZE, disk_size=TRANSLATION_CACHE_DISK_SIZE):
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.inserts = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS translation (key TEXT PRIMARY KEY, translation TEXT NOT NULL, last_used REAL NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS translation_last_used ON translation (last_used)")
+
+    @staticmethod
+    def make_key(text, target):
+        """规范化原文：全半角统一、去除首尾和连续空白"""
+        normalized = re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+        return f"{target}\0{normalized}"
+
+    def warm_load(self):
+        """预加载最近使用的翻译到内存"""
+        with self.lock:
+            rows = self.conn.execute("SELECT key, translation FROM translation ORDER BY last_used DESC LIMIT ?", (self.memory_size,)).fetchall()
+            for key, translation in reversed(rows):
+                self.memory[key] = translation
+        return len(rows)
+
+    def get(self, text, target):
+        """查询缓存，未命中时返回None"""
+        key = self.make_key(text, target)
+        with self.lock:
+            translation = self.memory.get(key)
+            if translation is not None:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return translation
+
+            row = self.conn.execute("SELECT translation FROM translation WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            with self.conn:
+                self.conn.execute("UPDATE translation SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.remember(key, row[0])
+            return row[0]
+
+    def put(self, text, target, translation):
+        """写入缓存，磁盘超出上限时删除最久未使用的条目"""
+        key = self.make_key(text, target)
+        with self.lock:
+            self.remember(key, translation)
+            with self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO translation (key, translation, last_used) VALUES (?, ?, ?)", (key, translation, time.time()))
+                self.inserts += 1
+                # 每写入一定条数检查一次上限
+                if self.inserts % 100 == 0:
+                    self.conn.execute(
+                        "DELETE FROM translation WHERE key IN (SELECT key FROM translation ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                        (self.disk_size,)
+                    )
+
+    def remember(self, key, translation):
+        """写入内存LRU，超出上限时淘汰最久未使用的"""
+        self.memory[key] = translation
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def describe(self):
+        """命中统计"""
+        total = self.memory_hits + self.disk_hits + self.misses
+        hit_rate = (self.memory_hits + self.disk_hits) / total * 100 if total else 0
+        return f"内存命中: {self.memory_hits} | 磁盘命中: {self.disk_hits} | 未命中: {self.misses} | 命中率: {hit_rate:.1f}%"
+
+class MemoryPromptBuilder:
+    """记忆提示词构建器，缓存各部分的渲染结果，只在数据变化或跨天时重新渲染"""
+    # 记忆核心各部分和会话摘要在提示词中的顺序
+    MEMORY_SECTIONS = ("promise", "preference", "motivation", "plan", "pivotal_memory", "diary")
+    SECTIONS = MEMORY_SECTIONS + ("session_summary",)
+    # 跨天时需要重新渲染的部分
+    DATE_SECTIONS = ("plan", "diary")
+    HEADER = "\n\n# 你的记忆\n*这是角色的记忆，在底色上参考记忆进行回复；注意这部分内容不是规则*\n"
+
+    def __init__(self, backend):
+        self.backend = backend
+        # 部分名到渲染结果的缓存
+        self.rendered = {}
+        self.day = None
+        self.prompt = None
+        self.prompt_hash = None
+
+    @staticmethod
+    def render_section(name, items):
+        """渲染单个部分，没有内容时返回空字符串"""
+        if not items:
+            return ""
+        if name == "promise":
+            lines = [f"{i}. {promise}" for i, promise in enumerate(items, 1)]
+            return "## 约定(你与用户的约定)\n" + "".join(line + "\n" for line in lines)
+        if name == "preference":
+            return "## 用户偏好\n" + "".join(f"{preference}\n" for preference in items)
+        if name == "motivation":
+            lines = [f"{i}. {motivation}" for i, motivation in enumerate(items, 1)]
+            return "## 动机(你的内心欲望)\n" + "".join(line + "\n" for line in lines)
+        if name == "plan":
+            return "## 计划(你的计划)\n" + "".join(f"{item['date']}: {item['content']}\n" for item in items)
+        if name == "pivotal_memory":
+            lines = [f"{i}. {memory}" for i, memory in enumerate(items, 1)]
+            return "## 关键记忆(你的转变经历)\n" + "".join(line + "\n" for line in lines)
+        if name == "diary":
+            return "## 日记\n" + "".join(f"{entry['date']}: {entry['content']}\n" for entry in items)
+        if name == "session_summary":
+            return f"## 本次会话摘要(已移出上下文的早些时候的对话)\n{items}\n"
+        raise ValueError(f"未知的记忆部分: {name}")
+
+    def section_items(self, name):
+        """获取部分对应的记忆数据"""
+        if name == "diary":
+            return self.backend.get_recent_diary(MEMORY_DAYS)
+        if name == "session_summary":
+            return self.backend.rolling_summary.published
+        return getattr(self.backend, f"memory_core_{name}")
+
+    def invalidate(self, *names):
+        """标记部分需要重新渲染，不指定时全部重新渲染"""
+        for name in names or self.SECTIONS:
+            self.rendered.pop(name, None)
+        self.prompt = None
+
+    def build(self):
+        """返回完整的系统提示词，内容未变化时直接返回缓存"""
+        today = date.today()
+        if today != self.day:
+            self.day = today
+            self.invalidate(*self.DATE_SECTIONS)
+
+        if self.prompt is None:
+            for name in self.SECTIONS:
+                if name not in self.rendered:
+                    self.rendered[name] = self.render_section(name, self.section_items(name))
+            memory_text = "".join(self.rendered[name] for name in self.SECTIONS).strip()
+            self.prompt = self.backend.fixed_system_prompt + self.HEADER + memory_text
+            # 内容哈希用于确认发送给服务商的前缀逐字节一致
+            self.prompt_hash = hashlib.sha256(self.prompt.encode("utf-8")).hexdigest()
+        return self.prompt
+
+class RollingSummarizer:
+    """会话增量总结器，上下文移出对话时在后台把移出的部分合并进会话摘要，完成后更新提示词中的摘要"""
+    def __init__(self, backend):
+        self.backend = backend
+        # 会话摘要和已总结到的后端长历史位置
+        self.summary = ""
+        self.cursor = 0
+        # 提示词中使用的摘要
+        self.published = ""
+        # 已移出上下文、还未总结的消息，以及它们在后端长历史中的结束位置
+        self.pending = []
+        self.pending_end = 0
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def on_turn(self):
+        """每轮对话结束后调用，上次总结失败时重试"""
+        if not USE_ROLLING_SUMMARY:
+            return
+        with self.lock:
+            has_pending = bool(self.pending)
+        if has_pending:
+            self.start()
+
+    def on_evicted(self, messages, end):
+        """上下文移出对话时调用，"end"为移出部分在后端长历史中的结束位置"""
+        if not USE_ROLLING_SUMMARY or not messages:
+            return
+        with self.lock:
+            self.pending.extend(messages)
+            self.pending_end = max(self.pending_end, end)
+        self.start()
+
+    def start(self):
+        """在后台线程中总结移出的对话，已有总结在进行时等它完成后继续"""
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            if not self.pending:
+                return
+            messages, self.pending = self.pending, []
+            end = self.pending_end
+            self.thread = threading.Thread(target=self.summarize, args=(messages, end), daemon=True)
+            self.thread.start()
+
+    def summarize(self, messages, end):
+        """将移出的对话合并进会话摘要"""
+        transcript = "\n".join(f"{msg['role']}: {self.strip_reasoning(msg['content'])}" for msg in messages)
+        with self.lock:
+            previous = self.summary
+        request = [
+            {"role": "system", "content": f"你负责维护一段对话的滚动摘要。请用第一人称(亚托莉)把新对话合并进已有摘要，按时间顺序保留事件、约定、情绪变化和未完成的话题，删除寒暄；只输出摘要正文，不超过{ROLLING_SUMMARY_MAX_CHARS}字。"},
+            {"role": "user", "content": f"# 已有摘要\n{previous or '无'}\n\n# 新对话\n{transcript}"}
+        ]
+        try:
+            summary, _, _ = self.backend.provider_registry.chat(request, stream=False, hedge=False, temperature=0.5, max_tokens=2048)
+            summary = (summary or "").strip()
+        except Exception as e:
+            print(f"警告| 会话增量总结失败: {str(e)}")
+            summary = ""
+
+        with self.lock:
+            if not summary:
+                # 失败的消息放回队首，下一轮重试
+                self.pending = messages + self.pending
+                return
+            self.summary = summary
+            self.cursor = max(self.cursor, end)
+            has_pending = bool(self.pending)
+        print(f"信息| 会话摘要已更新，已总结到后端长历史第{end}条: {summary[:100]}……")
+        # 摘要只包含已移出上下文的对话，可以直接进入提示词
+        self.publish()
+        if has_pending:
+            self.start()
+
+    def publish(self):
+        """将当前摘要用于提示词"""
+        with self.lock:
+            if self.summary == self.published:
+                return
+            self.published = self.summary
+        self.backend.memory_prompt.invalidate("session_summary")
+
+    @staticmethod
+    def strip_reasoning(content):
+        """去除AI回复中的思维链"""
+        if content.startswith("【") and "】\n\n" in content:
+            return content.split("】\n\n", 1)[1]
+        return content
+
+    def wait(self, timeout=None):
+        """等待进行中的总结完成"""
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def truncate(self, length):
+        """后端长历史被删除消息后调整已总结的位置"""
+        with self.lock:
+            self.cursor = min(self.cursor, length)
+            self.pending_end = min(self.pending_end, length)
+
+    def unsummarized(self, history):
+        """返回还未合并进会话摘要的对话"""
+        with self.lock:
+            return history[self.cursor:]
+
+class SentenceSplitter:
+    """增量分句器，从（流式）AI回复中切出完整的说话句子"""
+    END_CHARS = "。！？!?…~～\n"
+    SENTENCE_PATTERN = re.compile(r'[^。！？!?…~～\n]+[。！？!?…~～\n]*')
+    OPEN_CHARS = "（("
+    CLOSE_CHARS = "）)"
+
+    def __init__(self, extract_func):
+        # "extract_func"为`提取说话内容`
+        self.extract_func = extract_func
+        self.buffer = ""
+        self.carry = ""
+
+    def push(self, text):
+        """追加文本，返回已完整的句子"""
+        self.buffer += text
+        cut = self.find_safe_cut()
+        if cut <= 0:
+            return []
+        segment, self.buffer = self.buffer[:cut], self.buffer[cut:]
+        return self.split(segment, final=False)
+
+    def flush(self):
+        """结束输入，返回剩余的句子"""
+        segment, self.buffer = self.buffer, ""
+        return self.split(segment, final=True)
+
+    def find_safe_cut(self):
+        """查找括号外最后一个句末标点之后的位置"""
+        depth = 0
+        cut = 0
+        for i, char in enumerate(self.buffer):
+            if char in self.OPEN_CHARS:
+                depth += 1
+            elif char in self.CLOSE_CHARS:
+                depth = max(depth - 1, 0)
+            elif depth == 0 and char in self.END_CHARS:
+                # 句末标点连续出现时，等到标点结束再切分
+                next_char = self.buffer[i + 1] if i + 1 < len(self.buffer) else ""
+                if next_char and next_char not in self.END_CHARS:
+                    cut = i + 1
+        return cut
+
+    def split(self, segment, final):
+        """提取说话内容并分句"""
+        dialogue = self.extract_func(segment) if segment.strip() else ""
+        pieces = self.SENTENCE_PATTERN.findall(dialogue)
+
+        sentences = []
+        for piece in pieces:
+            self.carry += piece
+            # 过短的句子与下一句合并，减少TTS请求次数
+            if len(self.carry.strip()) >= MIN_SENTENCE_LENGTH:
+                sentences.append(self.carry.strip())
+                self.carry = ""
+
+        if final and self.carry.strip():
+            sentences.append(self.carry.strip())
+            self.carry = ""
+        return sentences
+
+class BilingualReplySplitter:
+    """双语回复分句器，从（流式）AI回复中切出说话内容和<ja>标签中的日语，缺少日语的说话内容留给翻译"""
+    OPEN_TAG = "<ja>"
+    CLOSE_TAG = "</ja>"
+
+    def __init__(self, extract_func):
+        # "extract_func"为`提取说话内容`
+        self.extract_func = extract_func
+        self.fallback_splitter = SentenceSplitter(extract_func)
+        self.buffer = ""
+        self.tagged_count = 0
+        self.fallback_count = 0
+
+    def push(self, text):
+        """追加文本，返回已完整的(说话内容, 日语)列表，日语为None时需要翻译"""
+        self.buffer += text
+        items = []
+        while True:
+            start = self.buffer.find(self.OPEN_TAG)
+            if start < 0:
+                break
+            end = self.buffer.find(self.CLOSE_TAG, start)
+            if end < 0:
+                break
+            before = self.buffer[:start]
+            japanese = self.buffer[start + len(self.OPEN_TAG):end].strip()
+            self.buffer = self.buffer[end + len(self.CLOSE_TAG):]
+            items += self.pair(before, japanese)
+        return items
+
+    def flush(self):
+        """结束输入，未闭合的标签视为格式错误，剩余的说话内容交给翻译"""
+        segment, self.buffer = self.buffer, ""
+        start = segment.find(self.OPEN_TAG)
+        if start >= 0:
+            print("警告| 双语回复的<ja>标签未闭合，使用翻译")
+            segment = segment[:start]
+        items = self.pair(self.display_text(segment), "")
+        if start < 0 and self.fallback_count and not self.tagged_count:
+            print("警告| 双语回复缺少<ja>标签，使用翻译")
+        return items
+
+    def pair(self, before, japanese):
+        """为日语配对前面的说话内容，没有日语时按句拆分后交给翻译"""
+        if japanese:
+            self.tagged_count += 1
+            dialogue = self.extract_func(before) if before.strip() else ""
+            return [(dialogue, japanese)]
+        sentences = self.fallback_splitter.split(before, final=True)
+        self.fallback_count += len(sentences)
+        return [(sentence, None) for sentence in sentences]
+
+    @classmethod
+    def display_text(cls, text):
+        """去除<ja>标签，用于显示和记忆匹配；流式回复中未闭合的标签和标签前缀也一并去除"""
+        text = re.sub(r"<ja>.*?(?:</ja>|$)", "", text, flags=re.DOTALL)
+        text = text.replace(cls.CLOSE_TAG, "")
+        for i in range(len(cls.OPEN_TAG) - 1, 0, -1):
+            if text.endswith(cls.OPEN_TAG[:i]):
+                return text[:-i]
+        return text
+
+class TTSAudioStream:
+    """流式TTS音频，后台线程接收分块并解析WAV头，播放端从缓冲中按顺序读取PCM"""
+    def __init__(self, response, chunk_size=TTS_STREAM_CHUNK_SIZE):
+        self.response = response
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue()
+        self.header = b""
+        self.sample_rate = None
+        self.channels = None
+        self.sample_width = None
+        self.received_bytes = 0
+        # 收到的全部PCM，用于调试录音
+        self.pcm_parts = []
+        self.exhausted = False
+        self.error = None
+        self.format_ready = threading.Event()
+        self.done = threading.Event()
+        # 取消后停止接收并关闭连接
+        self.cancelled = threading.Event()
+        threading.Thread(target=self.receive, daemon=True).start()
+
+    def cancel(self):
+        """取消接收，剩余音频不再下载"""
+        self.cancelled.set()
+
+    def receive(self):
+        """接收音频分块，WAV头之后按整帧放入缓冲"""
+        buffer = b""
+        try:
+            for chunk in self.response.iter_content(self.chunk_size):
+                if self.cancelled.is_set():
+                    return
+                if not chunk:
+                    continue
+                buffer += chunk
+                if not self.format_ready.is_set():
+                    buffer = self.parse_header(buffer)
+                    if buffer is None:
+                        buffer = b""
+                        continue
+                # 只放入整帧，剩余字节留到下一次
+                frame_size = self.channels * self.sample_width
+                usable = len(buffer) - len(buffer) % frame_size
+                if usable:
+                    self.pcm_parts.append(buffer[:usable])
+                    self.chunks.put(buffer[:usable])
+                    self.received_bytes += usable
+                    buffer = buffer[usable:]
+            if not self.format_ready.is_set():
+                raise ValueError("未收到完整的WAV头")
+        except Exception as e:
+            self.error = e
+            print(f"错误| 流式TTS接收异常: {str(e)}")
+        finally:
+            self.response.close()
+            self.chunks.put(None)
+            self.format_ready.set()
+            self.done.set()
+
+    def parse_header(self, buffer):
+        """解析WAV头，头不完整时返回None并继续累积"""
+        self.header += buffer
+        position = self.header.find(b"data", 12)
+        if not self.header.startswith(b"RIFF") or position < 0 or len(self.header) < position + 8:
+            return None
+        header_size = position + 8
+        with wave.open(io.BytesIO(self.header[:header_size]), "rb") as wav:
+            self.channels = wav.getnchannels()
+            self.sample_width = wav.getsampwidth()
+            self.sample_rate = wav.getframerate()
+        buffer, self.header = self.header[header_size:], self.header[:header_size]
+        self.format_ready.set()
+        return buffer
+
+    def to_wav(self):
+        """把收到的全部PCM重新封装为WAV"""
+        output = io.BytesIO()
+        with wave.open(output, "wb") as wav:
+            wav.setnchannels(self.channels)
+            wav.setsampwidth(self.sample_width)
+            wav.setframerate(self.sample_rate)
+            wav.writeframes(b"".join(self.pcm_parts))
+        return output.getvalue()
+
+    def bytes_per_second(self):
+        """每秒音频的字节数"""
+        return self.sample_rate * self.channels * self.sample_width
+
+    def read(self, min_bytes, block=True):
+        """读取PCM，阻塞时等到"min_bytes"字节或流结束，不阻塞时只读取已收到的部分；没有数据时返回None"""
+        data = bytearray()
+        while len(data) < min_bytes and not self.exhausted:
+            try:
+                chunk = self.chunks.get(block=block)
+            except queue.Empty:
+                break
+            if chunk is None:
+                self.exhausted = True
+                break
+            data += chunk
+        return bytes(data) or None
+
+class AudioRecorder:
+    """调试录音环，后台线程保存最近几条合成音频，超出条数时删除最早的"""
+    EXTENSIONS = {"wav": ".wav", "flac": ".flac", "ogg": ".ogg"}
+
+    def __init__(self, directory=DEBUG_AUDIO_DIR, keep=DEBUG_AUDIO_KEEP, audio_format=DEBUG_AUDIO_FORMAT):
+        self.directory = directory
+        self.keep = keep
+        self.audio_format = audio_format if audio_format in self.EXTENSIONS else "wav"
+        self.files = deque()
+        self.queue = queue.Queue()
+        self.thread = None
+        # 同一毫秒内保存多条录音时用序号区分文件名
+        self.sequence = 0
+
+    def load(self):
+        """读取已有的录音，只保留最近的"keep"条"""
+        os.makedirs(self.directory, exist_ok=True)
+        extensions = tuple(self.EXTENSIONS.values())
+        # 文件名中的毫秒时间戳和序号位数相同，按文件名排序即按时间排序
+        names = sorted(name for name in os.listdir(self.directory) if name.startswith("response_") and name.endswith(extensions))
+        self.files = deque(os.path.join(self.directory, name) for name in names)
+        self.trim()
+
+    def record(self, audio):
+        """添加一条录音，"audio"为WAV数据或流式TTS音频"""
+        if self.keep <= 0:
+            return
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.write_loop, daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+        self.queue.put(audio)
+
+    def write_loop(self):
+        """后台写入线程"""
+        while True:
+            audio = self.queue.get()
+            try:
+                if audio is None:
+                    return
+                self.write(audio)
+            except Exception as e:
+                print(f"警告| 调试录音保存失败: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    def close(self):
+        """保存剩余录音并停止后台线程"""
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def write(self, audio):
+        """写入一条录音并删除超出条数的旧录音"""
+        if isinstance(audio, TTSAudioStream):
+            audio.done.wait()
+            if audio.error is not None or audio.cancelled.is_set() or not audio.pcm_parts:
+                return
+            audio = audio.to_wav()
+
+        timestamp = f"{int(time.time() * 1000)}_{self.sequence:06d}"
+        self.sequence = (self.sequence + 1) % 1000000
+        soundfile = import_soundfile() if self.audio_format != "wav" else None
+        if soundfile is not None:
+            path = os.path.join(self.directory, f"response_{timestamp}{self.EXTENSIONS[self.audio_format]}")
+            data, sample_rate = soundfile.read(io.BytesIO(audio), dtype="int16")
+            subtype = "OPUS" if self.audio_format == "ogg" else None
+            soundfile.write(path, data, sample_rate, format=self.audio_format.upper(), subtype=subtype)
+        else:
+            path = os.path.join(self.directory, f"response_{timestamp}.wav")
+            with open(path, "wb") as f:
+                f.write(audio)
+
+        self.files.append(path)
+        self.trim()
+
+    def trim(self):
+        """删除超出条数的旧录音"""
+        while len(self.files) > max(self.keep, 0):
+            path = self.files.popleft()
+            try:
+                os.unlink(path)
+            except OSError as e:
+                print(f"警告| 调试录音清理失败: {e}")
+
+class SpeechPipeline:
+    """分句语音流水线，翻译、TTS和播放三个阶段并行"""
+    def __init__(self, backend_service):
+        self.backend_service = backend_service
+
+        # 输入队列不限长度，避免阻塞流式回复；阶段间队列限制长度
+        self.translate_queue = queue.Queue()
+        self.synthesize_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        self.play_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        self.played_count = 0
+        # 取消后各阶段跳过剩余的句子，只传递结束标记
+        self.cancelled = threading.Event()
+
+        self.threads = [
+            threading.Thread(target=self.translate_stage, daemon=True),
+            threading.Thread(target=self.synthesize_stage, daemon=True),
+            threading.Thread(target=self.play_stage, daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def feed(self, sentence, japanese=None):
+        """添加句子，已有日语时跳过翻译"""
+        self.translate_queue.put((sentence, japanese))
+
+    def finish(self):
+        """结束输入"""
+        self.translate_queue.put(None)
+
+    def cancel(self):
+        """取消流水线：清空各阶段队列并停止正在播放的音频"""
+        self.cancelled.set()
+        for stage_queue in (self.translate_queue, self.synthesize_queue, self.play_queue):
+            # 已经传到下游的结束标记要放回，保证每个阶段都能退出
+            has_end = False
+            while True:
+                try:
+                    has_end = stage_queue.get_nowait() is None or has_end
+                except queue.Empty:
+                    break
+            if has_end or stage_queue is self.translate_queue:
+                stage_queue.put(None)
+
+    def wait(self):
+        """等待所有句子播放完成"""
+        for thread in self.threads:
+            thread.join()
+        return self.played_count > 0
+
+    def translate_stage(self):
+        """翻译阶段，队列中已积压的句子合并为一次翻译请求"""
+        finished = False
+        while not finished:
+            items = [self.translate_queue.get()]
+            while items[-1] is not None:
+                try:
+                    items.append(self.translate_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if items[-1] is None:
+                items.pop()
+                finished = True
+            if self.cancelled.is_set():
+                continue
+
+            # 调用`批量中译日`处理，只翻译没有日语的句子
+            sentences = [sentence for sentence, _ in items]
+            texts = [japanese for _, japanese in items]
+            missing = [i for i, japanese in enumerate(texts) if japanese is None]
+            if missing:
+                try:
+                    translations = self.backend_service.translate_sentences([sentences[i] for i in missing])
+                    for i, translation in zip(missing, translations):
+                        texts[i] = translation
+                except Exception as e:
+                    print(f"错误| 翻译失败: {str(e)}")
+
+            for sentence, text in zip(sentences, texts):
+                if self.cancelled.is_set():
+                    break
+                if text:
+                    print(f"信息| 翻译后文本: {text}")
+                else:
+                    print("警告| 翻译错误，使用原文TTS")
+                    text = sentence
+                self.synthesize_queue.put(text)
+
+        self.synthesize_queue.put(None)
+
+    def synthesize_stage(self):
+        """TTS阶段"""
+        while True:
+            text = self.synthesize_queue.get()
+            if text is None:
+                self.play_queue.put(None)
+                return
+            if self.cancelled.is_set():
+                continue
+
+            # 调用`TTS合成`
+            audio = self.backend_service.synthesize_speech(text)
+            if audio:
+                self.play_queue.put(audio)
+            # 流式TTS接收完成后再请求下一句，按顺序占用TTS服务；取消时停止接收
+            if isinstance(audio, TTSAudioStream):
+                while not audio.done.wait(0.1):
+                    if self.cancelled.is_set():
+                        audio.cancel()
+                        break
+
+    def play_stage(self):
+        """播放阶段"""
+        while True:
+            audio = self.play_queue.get()
+            if audio is None:
+                return
+            if self.cancelled.is_set():
+                continue
+
+            # 调用`播放音频`
+            if self.backend_service.play_audio(audio, self.cancelled):
+                self.played_count += 1
+
+class SpeechStream:
+    """流式回复的语音流，边接收回复边送入分句流水线"""
+    def __init__(self, backend_service, on_delta=None):
+        self.on_delta_callback = on_delta
+        self.bilingual = USE_BILINGUAL_REPLY and USE_TRANSLATION
+        if self.bilingual:
+            self.splitter = BilingualReplySplitter(backend_service.extract_dialogue_content)
+        else:
+            self.splitter = SentenceSplitter(backend_service.extract_dialogue_content)
+        self.pipeline = SpeechPipeline(backend_service)
+        # 已送入分句器的回复内容
+        self.received = ""
+
+    def on_delta(self, kind, text):
+        """转发回复增量，并将完整的句子送入流水线"""
+        if self.on_delta_callback:
+            self.on_delta_callback(kind, text)
+        if kind == "content":
+            self.push(text)
+
+    def push(self, text):
+        """送入回复内容"""
+        self.received += text
+        self.feed(self.splitter.push(text))
+
+    def cancel(self):
+        """取消语音流"""
+        self.pipeline.cancel()
+
+    def finish(self):
+        """送入剩余句子并结束输入"""
+        self.feed(self.splitter.flush())
+        self.pipeline.finish()
+
+    def feed(self, items):
+        """送入句子，双语回复时附带日语"""
+        for item in items:
+            if self.bilingual:
+                self.pipeline.feed(*item)
+            else:
+                self.pipeline.feed(item)
+
+class ChatAIProvider:
+    """ChatAI服务商，记录首字延迟和错误率"""
+    def __init__(self, config, api_key, http_client=None):
+        self.name = config["name"]
+        self.kind = config["kind"]
+        self.model = config["model"]
+        self.base_url = config["base_url"]
+        self.max_temperature = config["max_temperature"]
+        self.api_key = api_key
+        self.http_client = http_client
+        self.client = None
+
+        # 滚动统计窗口
+        self.latencies = deque(maxlen=PROVIDER_STATS_WINDOW)
+        self.errors = deque(maxlen=PROVIDER_STATS_WINDOW)
+        self.stats_lock = threading.Lock()
+
+    def get_client(self):
+        """获取AI客户端，首次使用时创建"""
+        # 只导入实际使用的服务商SDK
+        if self.client is None:
+            if self.kind == "zhipu":
+                from zai import ZhipuAiClient
+                self.client = ZhipuAiClient(api_key=self.api_key)
+            else:
+                from openai import OpenAI
+                self.client = OpenAI(api_key=self.api_key, base_url=self.base_url, http_client=self.http_client)
+        return self.client
+
+    def record_latency(self, latency):
+        """记录首字延迟"""
+        with self.stats_lock:
+            self.latencies.append(latency)
+
+    def record_success(self):
+        """记录成功完成的请求"""
+        with self.stats_lock:
+            self.errors.append(False)
+
+    def record_error(self):
+        """记录失败请求"""
+        with self.stats_lock:
+            self.errors.append(True)
+
+    def percentile(self, percent):
+        """获取首字延迟的百分位数"""
+        with self.stats_lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        return latencies[int(round(percent / 100 * (len(latencies) - 1)))]
+
+    def error_rate(self):
+        """获取错误率"""
+        with self.stats_lock:
+            if not self.errors:
+                return 0.0
+            return sum(self.errors) / len(self.errors)
+
+    def describe(self):
+        """格式化统计信息"""
+        p50 = self.percentile(50)
+        p95 = self.percentile(95)
+        p50_text = f"{p50:.2f}s" if p50 is not None else "-"
+        p95_text = f"{p95:.2f}s" if p95 is not None else "-"
+        return f"{self.name} 首字延迟 p50 {p50_text} p95 {p95_text} 错误率 {self.error_rate() * 100:.0f}%"
+
+    def request(self, messages, stream, emit, cancel_event, **params):
+        """发送请求，通过"emit"回传事件"""
+        params["temperature"] = min(params.get("temperature", 1.0), self.max_temperature)
+        start_time = time.monotonic()
+
+        if not stream:
+            response = self.get_client().chat.completions.create(
+                model=self.model,
+                messages=messages,
+                **params
+            )
+            self.record_latency(time.monotonic() - start_time)
+            self.record_success()
+            message = response.choices[0].message
+            return message.content or "", getattr(message, 'reasoning_content', '') or "", response.usage
+
+        # 智谱AI在最后一个分块中默认返回Token用量
+        if self.kind == "openai":
+            params["stream_options"] = {"include_usage": True}
+        response_stream = self.get_client().chat.completions.create(
+            model=self.model,
+            messages=messages,
+            stream=True,
+            **params
+        )
+
+        content_parts = []
+        reasoning_parts = []
+        usage = None
+        first_token_time = None
+
+        try:
+            for chunk in response_stream:
+                # 对冲请求落选时中止
+                if cancel_event.is_set():
+                    return None
+                # 最后一个分块只携带Token用量
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+
+                delta = chunk.choices[0].delta
+                reasoning_delta = getattr(delta, "reasoning_content", None)
+                content_delta = delta.content
+                if (reasoning_delta or content_delta) and first_token_time is None:
+                    first_token_time = time.monotonic()
+                    # 首字只计入延迟，流完整结束后才计为成功
+                    self.record_latency(first_token_time - start_time)
+
+                # 思维链增量
+                if reasoning_delta:
+                    reasoning_parts.append(reasoning_delta)
+                    emit("reasoning", reasoning_delta)
+
+                # 回复增量
+                if content_delta:
+                    content_parts.append(content_delta)
+                    emit("content", content_delta)
+        finally:
+            if hasattr(response_stream, "close"):
+                response_stream.close()
+
+        self.record_success()
+        return "".join(content_parts), "".join(reasoning_parts), usage
+
+class ChatAIProviderRegistry:
+    """ChatAI服务商注册表，支持故障转移和对冲请求"""
+    def __init__(self, http_client=None):
+        self.providers = []
+        for config in CHATAI_PROVIDERS:
+            api_key = os.getenv(config["api_key_env"])
+            if api_key:
+                self.providers.append(ChatAIProvider(config, api_key, http_client))
+
+        if self.providers:
+            print(f"信息| 已启用ChatAI服务商: {[provider.name for provider in self.providers]}")
+        else:
+            print("警告| 未配置任何ChatAI服务商")
+
+    def ranked_providers(self):
+        """按优先级排列服务商，错误率过高的排到最后"""
+        return sorted(
+            self.providers,
+            key=lambda provider: provider.error_rate() > PROVIDER_MAX_ERROR_RATE
+        )
+
+    def run_attempt(self, provider, messages, stream, events, cancel_event, params):
+        """在子线程中向单个服务商发送请求"""
+        def emit(kind, text):
+            if not cancel_event.is_set():
+                events.put((kind, provider, text))
+
+        try:
+            result = provider.request(messages, stream, emit, cancel_event, **params)
+            events.put(("done", provider, result))
+        except Exception as e:
+            if not cancel_event.is_set():
+                provider.record_error()
+            events.put(("error", provider, e))
+
+    def chat(self, messages, on_delta=None, stream=USE_STREAM, hedge=USE_HEDGED_REQUEST, **params):
+        """请求ChatAI，返回回复、思维链和Token用量"""
+        if not self.providers:
+            raise RuntimeError("未配置任何ChatAI服务商")
+
+        pending_providers = self.ranked_providers()
+        events = queue.Queue()
+        cancel_events = {}
+        winner = None
+        last_error = None
+
+        def launch():
+            provider = pending_providers.pop(0)
+            cancel_events[provider] = threading.Event()
+            threading.Thread(
+                target=self.run_attempt,
+                args=(provider, messages, stream, events, cancel_events[provider], params),
+                daemon=True
+            ).start()
+
+        def choose(provider):
+            # 先出字者胜出，取消其他请求
+            for other, cancel_event in cancel_events.items():
+                if other is not provider:
+                    cancel_event.set()
+            return provider
+
+        launch()
+        active_count = 1
+        hedge_deadline = time.monotonic() + HEDGE_DELAY if hedge else None
+
+        while True:
+            timeout = None
+            if winner is None and hedge_deadline is not None:
+                timeout = max(hedge_deadline - time.monotonic(), 0)
+            try:
+                kind, provider, payload = events.get(timeout=timeout)
+            except queue.Empty:
+                # 主服务商超时未出字，向下一个服务商发出对冲请求
+                hedge_deadline = None
+                if pending_providers:
+                    print(f"信息| {HEDGE_DELAY}秒内未收到回复，发出对冲请求: {pending_providers[0].name}")
+                    launch()
+                    active_count += 1
+                continue
+
+            if kind == "error":
+                active_count -= 1
+                last_error = payload
+                print(f"错误| {provider.name} 请求失败: {str(payload)}")
+                if provider is winner:
+                    raise payload
+                if winner is None and active_count == 0:
+                    # 故障转移到下一个服务商
+                    if not pending_providers:
+                        raise last_error
+                    print(f"信息| 故障转移至: {pending_providers[0].name}")
+                    launch()
+                    active_count += 1
+                    if hedge:
+                        hedge_deadline = time.monotonic() + HEDGE_DELAY
+                continue
+
+            if winner is None:
+                winner = choose(provider)
+            if provider is not winner:
+                if kind == "done":
+                    active_count -= 1
+                continue
+
+            if kind == "done":
+                print(f"信息| {winner.describe()}")
+                return payload
+            if on_delta:
+                on_delta(kind, payload)
+
 class BackendService:
     """后端服务类"""
     def __init__(self):
@@ -75,32 +2298,68 @@ class BackendService:
         self.VOLC_ACCESS_KEY = os.getenv("VOLC_ACCESS_KEY")
         self.VOLC_SECRET_KEY = os.getenv("VOLC_SECRET_KEY")
 
-        # 初始化AI客户端，三选一
-        # DeepSeek
-        self.client = OpenAI(api_key=self.CHATAI_API_KEY, base_url="https://api.deepseek.com")
-        # 智谱AI
-        # self.client = ZhipuAiClient(api_key=self.CHATAI_API_KEY2)
-        # Qwen
-        # self.client = OpenAI(api_key=self.CHATAI_API_KEY3, base_url="https://dashscope.aliyuncs.com/compatible-mode/v1")
-        
-        # 调用`初始化音频系统`
-        self.init_audio_system()
+        # HTTP连接池和ChatAI服务商在`后台预热`中创建
+        self.http_session = None
+        self.llm_http_client = None
+        self.provider_registry = None
+
+        # 火山翻译服务实例，首次翻译时创建并复用
+        self.translate_service = None
+        self.translate_service_lock = threading.Lock()
+
+        # 翻译缓存，预热时加载
+        self.translation_cache = None
         
-        # 调用`音频清理`
-        self.audio_dir = self.clear_tts_output()
+        # 调用`创建调试录音环`
+        self.audio_recorder = self.create_audio_recorder()
+        self.audio_dir = self.audio_recorder.directory
     
         # 确保"memory_core"文件夹存在
         self.memory_core_dir = "memory_core"
         os.makedirs(self.memory_core_dir, exist_ok=True)
 
-        # 调用`加载记忆核心`
-        self.memory_core_diary, self.memory_core_promise, self.memory_core_plan, self.memory_core_preference, self.memory_core_motivation, self.memory_core_pivotal_memory = self.load_memory_core()
+        # 初始化记忆核心，在`后台预热`中加载
+        self.memory_core_diary = DiaryStore()
+        self.memory_core_promise = []
+        self.memory_core_plan = []
+        self.memory_core_preference = []
+        self.memory_core_motivation = []
+        self.memory_core_pivotal_memory = []
+
+        # 初始化日记Essence索引，加载记忆核心后重建
+        self.essence_index = EssenceIndex()
+        # 冷日记存储，"DIARY_HOT_DAYS"为None或使用SQLite时不创建
+        self.cold_diary = None
+        # SQLite记忆核心存储，"MEMORY_BACKEND"为"sqlite"时在加载记忆核心时创建
+        self.memory_store = None
+        # 日记语义检索索引，未启用或缺少numpy时为None
+        self.semantic_index = None
 
         # 初始化相关记忆
         self.related_memories = []
         
         # 初始化上次AI回复列表，存储AI回复
         self.last_ai_response = ""
+
+        # 初始化流式回复的语音流
+        self.pending_speech = None
+
+        # 初始化耗时追踪
+        self.tracer = TurnTracer()
+        # 相关记忆排序器
+        self.memory_ranker = MemoryRanker()
+        # 会话增量总结器
+        self.rolling_summary = RollingSummarizer(self)
+        # 记忆提示词构建器
+        self.memory_prompt = MemoryPromptBuilder(self)
+
+        # 初始化上下文缓存统计
+        self.cache_hit_tokens = 0
+        self.cache_miss_tokens = 0
+
+        # 初始化Token估算校准系数和上次请求的估算值
+        self.token_scale = 1.0
+        self.last_prompt_estimate = 0
         
         # 固定系统提示词
         self.fixed_system_prompt = """
@@ -175,8 +2434,16 @@ class BackendService:
         3. 描述内容是第一人称
         """.strip()
 
-        # 构造包含"你的记忆"的系统提示词
-        self.system_prompt = self.fixed_system_prompt + "\n\n# 你的记忆\n*这是角色的记忆，在底色上参考记忆进行回复；注意这部分内容不是规则*\n" + self.format_memory_for_prompt(MEMORY_DAYS)
+        # 双语回复时，要求说话内容后附带日语，省去翻译请求
+        if USE_BILINGUAL_REPLY and USE_TRANSLATION:
+            self.fixed_system_prompt += "\n\n" + """
+        ## 双语回复
+        每段说话内容后紧跟`<ja>日语</ja>`，日语为这段说话内容的自然口语翻译，描述内容不需要翻译
+        - 例：（眼里冒着闪光）可以嘛~<ja>いいの～？</ja>（双手抱住你的手臂）可以嘛~<ja>いいでしょ～？</ja>
+        """.strip()
+
+        # 系统提示词在加载记忆核心后补全"你的记忆"
+        self.system_prompt = self.fixed_system_prompt
 
         # 初始化后端历史，用于上下文
         self.backend_history = [{"role": "system", "content": self.system_prompt}]
@@ -184,26 +2451,145 @@ class BackendService:
         # 初始化后端长历史，用于对话总结
         self.backend_long_history = []
         
-        # 调用`加载短期记忆`
+        # 长期记忆归档，按月分段
+        self.long_term_archive = LongTermArchive(LONG_TERM_MEMORY_DIR)
+
+        # 短期记忆日志，只追加写入
+        self.short_term_log = ShortTermMemoryLog(SHORT_TERM_MEMORY_FILE)
+
+        # 调用`加载短期记忆`，启动时即可显示历史
         self.load_short_term_memory_from_file()
-        
-        # 调用方法检测TTS和ChatAI服务
-        self.use_chatai = self.test_chatai_service()
+
+        # 服务状态和开场白在`后台预热`中获取
+        self.use_chatai = False
+        self.tts_success = False
+        self.opening_line = None
+        # 双语回复的原始内容(含<ja>标签)，播放时用于取回日语
+        self.last_raw_response = None
+
+    def warm_up(self, on_delta=None):
+        """后台预热：加载记忆、检测服务并生成开场白"""
+        self.tracer.begin_turn("opening")
+
+        # 调用`创建HTTP连接池`，所有外部服务复用长连接
+        self.http_session = self.create_http_session()
+        self.llm_http_client = self.create_llm_http_client()
+
+        # 初始化ChatAI服务商，按"CHATAI_PROVIDERS"的优先级故障转移
+        self.provider_registry = ChatAIProviderRegistry(self.llm_http_client)
+
+        # 调用`初始化音频系统`
+        self.init_audio_system()
+
+        # 调用`加载记忆核心`
+        with self.tracer.span("memory_load"):
+            self.memory_core_diary, self.memory_core_promise, self.memory_core_plan, self.memory_core_preference, self.memory_core_motivation, self.memory_core_pivotal_memory = self.load_memory_core()
+            self.essence_index = EssenceIndex(self.memory_core_diary)
+
+        # 调用`加载语义检索索引`
+        if USE_SEMANTIC_RECALL:
+            with self.tracer.span("semantic_load"):
+                self.semantic_index = self.load_semantic_index()
+
+        # 调用`更新系统提示词`，构造包含"你的记忆"的系统提示词
+        self.refresh_system_prompt()
+
+        # 调用`加载翻译缓存`
+        if USE_TRANSLATION and USE_TRANSLATION_CACHE:
+            self.translation_cache = self.load_translation_cache()
+
+        # 调用方法检测TTS和ChatAI服务，TTS连通性检测与ChatAI请求并行
         self.tts_success = self.test_tts_service()
+        threading.Thread(target=self.check_tts_reachable, daemon=True).start()
+        self.use_chatai = self.test_chatai_service(on_delta)
 
         # 调用`将测试回复作为开场白`
         self.opening_line = self.generate_opening_line()
+        return self.opening_line
+
+    def create_http_session(self):
+        """创建HTTP连接池，用于TTS请求"""
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def create_llm_http_client(self):
+        """创建ChatAI客户端的HTTP连接池"""
+        import httpx
+
+        return httpx.Client(
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_SIZE,
+                max_keepalive_connections=HTTP_POOL_SIZE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0)
+        )
+
+    def load_translation_cache(self):
+        """加载翻译缓存，并预加载最近使用的翻译到内存"""
+        try:
+            cache = TranslationCache(TRANSLATION_CACHE_FILE)
+            count = cache.warm_load()
+            print(f"信息| 翻译缓存已加载 | 预加载: {count}条")
+            return cache
+        except sqlite3.Error as e:
+            print(f"警告| 翻译缓存加载失败，将不使用缓存 | 错误: {str(e)}")
+            return None
+
+    def get_translate_service(self):
+        """获取火山翻译服务实例"""
+        # 服务实例内部持有连接池，只创建一次
+        with self.translate_service_lock:
+            if self.translate_service is None:
+                from volcengine.ApiInfo import ApiInfo
+                from volcengine.Credentials import Credentials
+                from volcengine.ServiceInfo import ServiceInfo
+                from volcengine.base.Service import Service
+
+                # 服务信息
+                service_info = ServiceInfo(
+                    TRANSLATE_API_HOST,
+                    {'Content-Type': 'application/json'},
+                    Credentials(self.VOLC_ACCESS_KEY, self.VOLC_SECRET_KEY, 'translate', 'cn-north-1'),
+                    5,
+                    5
+                )
+                
+                # API信息
+                api_info = {
+                    'translate': ApiInfo(
+                        'POST', 
+                        '/', 
+                        {'Action': 'TranslateText', 'Version': '2020-06-01'},
+                        {}, 
+                        {}
+                    )
+                }
+                
+                # 创建服务实例
+                self.translate_service = Service(service_info, api_info)
+            return self.translate_service
 
     def load_memory_core(self):
         """加载记忆核心"""
         # 初始化列表
-        diary = []
+        diary = DiaryStore()
         promise = []
         plan = []
         preference = []
         motivation = []
         pivotal_memory = []
         
+        # 调用`加载SQLite记忆核心`
+        if MEMORY_BACKEND == "sqlite":
+            return self.load_memory_core_sqlite()
+
         try:
             # 加载日记，支持多个Essence值
             diary_path = os.path.join(self.memory_core_dir, "memory_core_diary.json")
@@ -215,6 +2601,9 @@ class BackendService:
                         if "essences" not in entry:
                             entry["essences"] = []
                     diary = diary_data
+                    
+            # 调用`分离冷日记`，日记按日期建立索引
+            diary = self.split_cold_diary(diary)
             
             # 加载约定
             promise_path = os.path.join(self.memory_core_dir, "memory_core_promise.json")
@@ -250,123 +2639,164 @@ class BackendService:
             print(f"警告| 加载记忆核心失败: {str(e)}")
         
         return diary, promise, plan, preference, motivation, pivotal_memory
+
+    def split_cold_diary(self, diary):
+        """将早于热日记范围的日记移入冷存储，返回日记存储"""
+        if DIARY_HOT_DAYS is None:
+            return DiaryStore(diary)
+
+        self.cold_diary = ColdDiaryArchive(os.path.join(self.memory_core_dir, DIARY_COLD_DIR))
+        cold_entries = self.cold_diary.load()
+
+        old_entries = [entry for entry in diary if DiaryStore.is_old(entry["date"], DIARY_HOT_DAYS)]
+        if old_entries:
+            # 首次移出前备份原日记文件
+            diary_path = os.path.join(self.memory_core_dir, "memory_core_diary.json")
+            if os.path.exists(diary_path) and not os.path.exists(diary_path + ".bak"):
+                shutil.copy2(diary_path, diary_path + ".bak")
+            self.cold_diary.add(old_entries)
+            diary = [entry for entry in diary if not DiaryStore.is_old(entry["date"], DIARY_HOT_DAYS)]
+            # 冷存储写入成功后再从日记文件中移除
+            self.save_memory_core_files({"diary": diary}, diary)
+            cold_entries = [{"date": entry["date"], "essences": entry.get("essences", [])} for entry in old_entries] + cold_entries
+            print(f"信息| 已将{len(old_entries)}条日记移入冷存储")
+
+        # 热日记在后，覆盖冷存储中的同一日期
+        return DiaryStore(cold_entries + list(diary), self.cold_diary.read)
+
+    def load_memory_core_sqlite(self):
+        """从SQLite加载记忆核心，首次启用时迁移JSON文件"""
+        try:
+            self.memory_store = SQLiteMemoryStore(os.path.join(self.memory_core_dir, MEMORY_DB_FILE))
+            if not self.memory_store.is_migrated():
+                self.memory_store.migrate_from_json(self.memory_core_dir)
+            diary, promise, plan, preference, motivation, pivotal_memory = self.memory_store.load(DIARY_HOT_DAYS)
+            return DiaryStore(diary, self.memory_store.read_diary_content), promise, plan, preference, motivation, pivotal_memory
+        except Exception as e:
+            print(f"警告| 加载SQLite记忆核心失败: {str(e)}")
+            return DiaryStore(), [], [], [], [], []
     
     def match_essences_with_text(self, text):
         """匹配文本与日记中的Essence"""
         matched_memories = []
         
-        # 获取部分日记用于与系统提示词去重
-        recent_diary_dates = set()
-        recent_diary = self.get_recent_diary(MEMORY_DAYS)
-        for entry in recent_diary:
-            recent_diary_dates.add(entry["date"])
+        # 获取部分日记的日期用于与系统提示词去重
+        recent_diary_dates = set(self.memory_core_diary.latest_dates(MEMORY_DAYS))
         
-        # 遍历所有日记条目
-        for entry in self.memory_core_diary:
+        if not isinstance(text, str):
+            return matched_memories
+
+        # 调用`日记Essence索引`，一次扫描文本得到所有匹配的日记
+        for date, essence in self.essence_index.match(text):
             # 跳过已经在"你的记忆"中出现的日记
-            if entry["date"] in recent_diary_dates:
+            if date in recent_diary_dates:
                 continue
-                
-            # 检查每个Essence值
-            for essence in entry.get("essences", []):
-                # 关键词匹配
-                if isinstance(text, str) and essence.lower() in text.lower():
-                    matched_memories.append({
-                        "date": entry["date"],
-                        "content": entry["content"],
-                        "matched_essence": essence
-                    })
-                    # 每个日记条目只匹配一次
-                    break
+            # 内容在选中后再读取，避免冷日记被全部读出
+            matched_memories.append({
+                "date": date,
+                "matched_essence": essence
+            })
         
         return matched_memories
     
+    def load_semantic_index(self):
+        """加载语义检索索引，只重新计算新增或修改的日记"""
+        if import_numpy() is None:
+            return None
+        try:
+            index = SemanticIndex(os.path.join(self.memory_core_dir, "semantic_index.npz"))
+            index.load()
+            index.sync(self.memory_core_diary)
+            index.save()
+            # 之后的增量更新只在退出时写入一次；未写入的变化在下次加载时由内容指纹重新计算
+            atexit.register(index.save)
+            print(f"信息| 语义检索索引已加载，共{len(index.dates)}条日记")
+            return index
+        except Exception as e:
+            print(f"警告| 加载语义检索索引失败，将禁用语义检索: {str(e)}")
+            return None
+
+    def search_semantic_memories(self, text):
+        """语义检索与文本相关的日记"""
+        if self.semantic_index is None:
+            return []
+        # 跳过已经在"你的记忆"中出现的日记
+        exclude = self.memory_core_diary.latest_dates(MEMORY_DAYS)
+        return [
+            {
+                "date": date,
+                "matched_essence": None,
+                "score": score
+            }
+            for date, score in self.semantic_index.search(text, exclude=exclude)
+        ]
+
+    def select_related_memories(self, ai_matched_memories, user_matched_memories, semantic_memories):
+        """合并候选记忆，调用`相关记忆排序器`打分后按条数和Token预算选择"""
+        # 按日期合并候选：用户输入命中计1次，上一次AI回复命中计0.5次
+        candidates = {}
+        for weight, memories in ((0.5, ai_matched_memories), (1.0, user_matched_memories), (0.0, semantic_memories)):
+            for memory in memories:
+                candidate = candidates.setdefault(memory["date"], {"date": memory["date"], "matched_essence": None, "match": 0.0, "rarity": 0.0, "semantic": 0.0})
+                candidate["match"] += weight
+                if memory["matched_essence"] is not None:
+                    candidate["matched_essence"] = candidate["matched_essence"] or memory["matched_essence"]
+                    candidate["rarity"] = max(candidate["rarity"], self.essence_index.rarity(memory["matched_essence"]))
+                if "score" in memory:
+                    candidate["semantic"] = memory["score"]
+
+        ranked = self.memory_ranker.rank(list(candidates.values()), RECALL_BUDGET_COUNT)
+
+        # 读取选中记忆的内容，超出Token预算的跳过
+        selected_memories = []
+        used_tokens = 0
+        for candidate in ranked:
+            content = self.memory_core_diary.get(candidate["date"])["content"]
+            if RECALL_BUDGET_TOKENS is not None:
+                tokens = self.estimate_text_tokens(f"{candidate['date']}: {content}")
+                if used_tokens + tokens > RECALL_BUDGET_TOKENS:
+                    continue
+                used_tokens += tokens
+            selected_memories.append({"date": candidate["date"], "content": content, "matched_essence": candidate["matched_essence"]})
+
+        self.memory_ranker.record_usage([memory["date"] for memory in selected_memories])
+        return selected_memories
+
     def format_memory_for_prompt(self, days=None):
         """格式化记忆核心用于系统提示词"""
         if days is None:
             days = MEMORY_DAYS
-        recent_diary = self.get_recent_diary(days)
         
-        # 格式化输出
+        # 调用`记忆提示词构建器`的渲染方法，与系统提示词格式一致
         memory_text = ""
-        
-        if self.memory_core_promise:
-            memory_text += "## 约定(你与用户的约定)\n"
-            for i, promise in enumerate(self.memory_core_promise, 1):
-                memory_text += f"{i}. {promise}\n"
-        
-        if self.memory_core_preference:
-            memory_text += "## 用户偏好\n"
-            for i, preference in enumerate(self.memory_core_preference, 1):
-                memory_text += f"{preference}\n"
-        
-        if self.memory_core_motivation:
-            memory_text += "## 动机(你的内心欲望)\n"
-            for i, motivation in enumerate(self.memory_core_motivation, 1):
-                memory_text += f"{i}. {motivation}\n"
-        
-        if self.memory_core_plan:
-            memory_text += "## 计划(你的计划)\n"
-            for plan_item in self.memory_core_plan:
-                memory_text += f"{plan_item['date']}: {plan_item['content']}\n"
-        
-        if self.memory_core_pivotal_memory:
-            memory_text += "## 关键记忆(你的转变经历)\n"
-            for i, memory in enumerate(self.memory_core_pivotal_memory, 1):
-                memory_text += f"{i}. {memory}\n"
-        
-        if recent_diary:
-            memory_text += "## 日记\n"
-            for entry in recent_diary:
-                memory_text += f"{entry['date']}: {entry['content']}\n"
+        for name in MemoryPromptBuilder.MEMORY_SECTIONS:
+            if name == "diary":
+                items = self.get_recent_diary(days)
+            else:
+                items = getattr(self, f"memory_core_{name}")
+            memory_text += MemoryPromptBuilder.render_section(name, items)
         
         return memory_text.strip()
 
+    def refresh_system_prompt(self):
+        """用缓存的记忆提示词更新系统提示词，内容变化时才替换"""
+        prompt = self.memory_prompt.build()
+        if prompt != self.system_prompt:
+            self.system_prompt = prompt
+            self.backend_history[0]["content"] = prompt
+            print(f"信息| 系统提示词已更新 | 哈希: {self.memory_prompt.prompt_hash[:16]}")
+
     def get_recent_diary(self, days=None):
         """获取部分日记用于系统提示词"""
         if days is None:
             days = MEMORY_DAYS
-        if not self.memory_core_diary:
-            return []
         
-        # 按日期排序，最新的在前面
-        try:
-            sorted_diary = sorted(
-                self.memory_core_diary, 
-                key=lambda x: datetime.strptime(x['date'], "%Y年%m月%d日"), 
-                reverse=True
-            )
-        except ValueError:
-            # 兼容旧格式
-            sorted_diary = sorted(
-                self.memory_core_diary, 
-                key=lambda x: datetime.strptime(x['date'], "%m月%d日"), 
-                reverse=True
-            )
-        
-        return sorted_diary[:days]
+        # 日记已按日期排序，最新的在前面
+        return self.memory_core_diary.latest(days)
 
     def get_recent_diary_for_recursion(self, days=2):
         """获取部分日记用于递归总结"""
-        if not self.memory_core_diary:
-            return []
-        
-        # 按日期排序，最新的在前面
-        try:
-            sorted_diary = sorted(
-                self.memory_core_diary, 
-                key=lambda x: datetime.strptime(x['date'], "%Y年%m月%d日"), 
-                reverse=True
-            )
-        except ValueError:
-            # 兼容旧格式
-            sorted_diary = sorted(
-                self.memory_core_diary, 
-                key=lambda x: datetime.strptime(x['date'], "%m月%d日"), 
-                reverse=True
-            )
-        
-        return sorted_diary[:days]
+        return self.memory_core_diary.latest(days)
         
     def save_memory_core(self, summary_data):
         """保存记忆核心"""
@@ -378,69 +2808,50 @@ class BackendService:
             # 日记只覆盖相同日期；其余类别新数据覆盖旧数据
             # 保存日记
             if 'diary' in summary_data:
-                # 创建日期到日记条目的映射
-                existing_diary_map = {entry['date']: entry for entry in self.memory_core_diary}
-                new_diary_map = {entry['date']: entry for entry in summary_data['diary']}
-                
-                # 更新现有日记中相同日期的条目
-                for date, entry in new_diary_map.items():
-                    existing_diary_map[date] = entry
-                
-                # 转换回列表并保持时间顺序
-                updated_diary = list(existing_diary_map.values())
-                # 兼容旧格式
-                try:
-                    updated_diary.sort(key=lambda x: datetime.strptime(x['date'], "%Y年%m月%d日"))
-                except ValueError:
-                    updated_diary.sort(key=lambda x: datetime.strptime(x['date'], "%m月%d日"))
-                
-                self.memory_core_diary = updated_diary
-                diary_path = os.path.join(self.memory_core_dir, "memory_core_diary.json")
-                with open(diary_path, "w", encoding="utf-8") as file:
-                    json.dump(self.memory_core_diary, file, ensure_ascii=False, indent=4)
-            
-            # 保存约定
-            if 'promise' in summary_data:
-                self.memory_core_promise = summary_data['promise']
-                promise_path = os.path.join(self.memory_core_dir, "memory_core_promise.json")
-                with open(promise_path, "w", encoding="utf-8") as file:
-                    json.dump(self.memory_core_promise, file, ensure_ascii=False, indent=4)
+                # 更新相同日期的条目，同时更新Essence索引；日记始终保持时间顺序
+                for entry in summary_data['diary']:
+                    entry.setdefault("essences", [])
+                    self.memory_core_diary.upsert(entry)
+                    self.essence_index.upsert(entry)
+                self.memory_prompt.invalidate("diary")
+
+                # 增量更新语义检索索引，退出时写入磁盘
+                if self.semantic_index is not None:
+                    for entry in summary_data['diary']:
+                        self.semantic_index.upsert(entry["date"], SemanticIndex.entry_text(entry))
             
-            # 保存用户偏好
-            if 'preference' in summary_data:
-                self.memory_core_preference = summary_data['preference']
-                preference_path = os.path.join(self.memory_core_dir, "memory_core_preference.json")
-                with open(preference_path, "w", encoding="utf-8") as file:
-                    json.dump(self.memory_core_preference, file, ensure_ascii=False, indent=4)
-            
-            # 保存计划
-            if 'plan' in summary_data:
-                self.memory_core_plan = summary_data['plan']
-                plan_path = os.path.join(self.memory_core_dir, "memory_core_plan.json")
-                with open(plan_path, "w", encoding="utf-8") as file:
-                    json.dump(self.memory_core_plan, file, ensure_ascii=False, indent=4)
-            
-            # 保存动机
-            if 'motivation' in summary_data:
-                self.memory_core_motivation = summary_data['motivation']
-                motivation_path = os.path.join(self.memory_core_dir, "memory_core_motivation.json")
-                with open(motivation_path, "w", encoding="utf-8") as file:
-                    json.dump(self.memory_core_motivation, file, ensure_ascii=False, indent=4)
-            
-            # 保存关键记忆
-            if 'pivotal_memory' in summary_data:
-                self.memory_core_pivotal_memory = summary_data['pivotal_memory']
-                pivotal_memory_path = os.path.join(self.memory_core_dir, "memory_core_pivotal_memory.json")
-                with open(pivotal_memory_path, "w", encoding="utf-8") as file:
-                    json.dump(self.memory_core_pivotal_memory, file, ensure_ascii=False, indent=4)
+            # 其余类别新数据覆盖旧数据：约定、用户偏好、计划、动机、关键记忆
+            for name in ("promise", "preference", "plan", "motivation", "pivotal_memory"):
+                if name in summary_data:
+                    setattr(self, f"memory_core_{name}", summary_data[name])
+                    self.memory_prompt.invalidate(name)
+
+            # 写入存储：SQLite在一个事务中只写入变化的行，JSON重写对应文件
+            if self.memory_store is not None:
+                self.memory_store.save(summary_data)
+            else:
+                self.save_memory_core_files(summary_data)
             
             print("信息| 记忆核心已保存")
         except Exception as e:
             print(f"警告| 保存记忆核心失败: {str(e)}")
 
+    def save_memory_core_files(self, summary_data, diary=None):
+        """将总结结果涉及的类别写入memory_core下的JSON文件，日记文件只包含热日记"""
+        for name in ("diary", "promise", "preference", "plan", "motivation", "pivotal_memory"):
+            if name not in summary_data:
+                continue
+            if name == "diary":
+                data = diary if diary is not None else self.memory_core_diary.hot_entries()
+            else:
+                data = getattr(self, f"memory_core_{name}")
+            path = os.path.join(self.memory_core_dir, f"memory_core_{name}.json")
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(data, file, ensure_ascii=False, indent=4)
+
     def play_opening_line(self):
         """处理开场白播放"""
-        if self.tts_success and hasattr(self, 'opening_line'):
+        if self.tts_success and self.opening_line:
             return self.process_ai_response(self.opening_line)
         return False
 
@@ -457,35 +2868,33 @@ class BackendService:
 
     def init_audio_system(self):
         """初始化音频系统"""
+        import pygame
+
         pygame.mixer.init()
 
-    def clear_tts_output(self):
-        """音频清理"""
-        audio_dir = "debug"
-        os.makedirs(audio_dir, exist_ok=True)
-        for filename in os.listdir(audio_dir):
-            if filename.lower().endswith('.wav'):
-                file_path = os.path.join(audio_dir, filename)
-                try:
-                    if os.path.isfile(file_path):
-                        os.unlink(file_path)
-                except Exception as e:
-                    print(f"警告| 音频清理失败: {e}")
-        return audio_dir
+    def create_audio_recorder(self):
+        """创建调试录音环，清理超出条数的旧录音"""
+        recorder = AudioRecorder()
+        try:
+            recorder.load()
+        except OSError as e:
+            print(f"警告| 调试录音目录不可用，将不保存录音: {e}")
+            recorder.keep = 0
+        return recorder
     
     def load_short_term_memory_from_file(self):
         """加载短期记忆"""
-        file_path = "short_term_memory.json"
-        if not os.path.exists(file_path):
-            print("信息| 未找到短期记忆")
-            return
-
+        # 写入线程在读取完成后启动
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                data = json.load(file)
+            # 旧版的short_term_memory.json一次性迁移为日志
+            if os.path.exists("short_term_memory.json") and not os.path.exists(SHORT_TERM_MEMORY_FILE):
+                self.short_term_log.migrate_from_json("short_term_memory.json")
+            if not os.path.exists(SHORT_TERM_MEMORY_FILE):
+                print("信息| 未找到短期记忆")
+                return
 
-            # 过滤"system"消息
-            filtered_data = [msg for msg in data if msg.get("role") != "system"]
+            # 从日志末尾读取，不解析整个文件；日志中没有"system"消息
+            filtered_data = self.short_term_log.load()
 
             # 分别加载指定条数用于上下文和对话总结
             recent_messages_for_context = filtered_data[-SHORT_TERM_MEMORY_MESSAGES:]
@@ -500,6 +2909,8 @@ class BackendService:
 
         except Exception as e:
             print(f"警告| 加载短期记忆出错: {e}")
+        finally:
+            self.short_term_log.start()
 
     def add_timestamp_to_messages(self):
         """为消息添加时间戳"""
@@ -510,41 +2921,18 @@ class BackendService:
 
     def save_long_term_memory(self):
         """保存长期记忆"""
-        # 只保存不调用，未完善且有BUG
         try:
-            file_path = "long_term_memory.json"
-            
-            # 过滤"system"消息
-            non_system_messages = [msg for msg in self.backend_history if msg.get("role") != "system"]
-            
-            if not non_system_messages:
-                return
-                
-            # 读取长期记忆
-            if os.path.exists(file_path):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-            else:
-                existing_data = []
-            
-            # 只保存新消息
-            new_messages = []
-            for msg in non_system_messages:
-                if msg not in existing_data:
-                    new_messages.append(msg)
-            
-            if not new_messages:
+            # 旧版的long_term_memory.json一次性迁移为按月分段的归档
+            if os.path.exists("long_term_memory.json"):
+                self.long_term_archive.migrate_from_json("long_term_memory.json")
+
+            # 只追加还未归档或归档后修改过的消息，按消息ID和内容去重
+            saved_count = self.long_term_archive.append_new(self.backend_history)
+            if not saved_count:
                 print("信息| 没有新消息需要保存到长期记忆")
                 return
-                
-            # 合并数据
-            updated_data = existing_data + new_messages
-            
-            # 写回文件
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(updated_data, f, ensure_ascii=False, indent=4)
 
-            print(f"信息| 保存{len(new_messages)}条新消息到长期记忆")
+            print(f"信息| 保存{saved_count}条新消息到长期记忆")
 
         except Exception as e:
             print(f"警告| 保存长期记忆出错: {e}")
@@ -572,7 +2960,7 @@ class BackendService:
         current_time = datetime.now()
         return current_time.strftime("%Y年%m月%d日")
 
-    def test_chatai_service(self):
+    def test_chatai_service(self, on_delta=None):
         """测试ChatAI服务"""
         print("信息| 测试ChatAI……")
         try:
@@ -580,8 +2968,8 @@ class BackendService:
             time_info = f"{self.get_timeinfo_2()}"
             
             # 检查两个条件
-            short_term_memory_exists = os.path.exists("short_term_memory.json")
-            memory_core_diary_exists = os.path.exists(os.path.join("memory_core", "memory_core_diary.json"))
+            short_term_memory_exists = os.path.exists(SHORT_TERM_MEMORY_FILE) or os.path.exists("short_term_memory.json")
+            memory_core_diary_exists = len(self.memory_core_diary) > 0 or os.path.exists(os.path.join("memory_core", "memory_core_diary.json"))
             
             # 根据条件设置不同的请求消息
             if short_term_memory_exists or memory_core_diary_exists:
@@ -595,12 +2983,18 @@ class BackendService:
             self.backend_history.append({"role": "user", "content": test_content})
             self.backend_long_history.append({"role": "user", "content": test_content})
             
+            # 流式回复时，边接收开场白边进行分句翻译、TTS和播放
+            if USE_STREAM and USE_SPEECH_PIPELINE and self.tts_success:
+                self.pending_speech = SpeechStream(self, on_delta)
+                on_delta = self.pending_speech.on_delta
+
             # 调用`请求ChatAI`
-            content, reasoning_content, tokens_used = self.call_chatai()
+            content, reasoning_content, tokens_used = self.call_chatai(on_delta)
             
             # 清理AI回复
             content = content.strip()
             reasoning_content = reasoning_content.strip() if reasoning_content else ""
+            self.last_raw_response = content
 
             # 按格式组合思维链和最终回复
             combined_content = f"【{reasoning_content}】\n\n{content}" if reasoning_content else content
@@ -625,10 +3019,10 @@ class BackendService:
         """测试TTS服务"""
         print("信息| 测试TTS服务……")
         try:
-            test_dir = os.path.join(self.audio_dir)
-            if not os.access(test_dir, os.W_OK):
-                print("错误| TTS输出文件夹不可写")
-                return False
+            # 音频在内存中播放，录音目录不可写时只停止保存录音
+            if self.audio_recorder.keep > 0 and not os.access(self.audio_dir, os.W_OK):
+                print("警告| 调试录音文件夹不可写，将不保存录音")
+                self.audio_recorder.keep = 0
                 
             print("信息| TTS服务连接正常")
             return True
@@ -636,6 +3030,17 @@ class BackendService:
             print(f"错误| TTS文件夹访问失败: {str(e)}")
             return False
 
+    def check_tts_reachable(self):
+        """检测TTS服务连通性，同时预先建立长连接"""
+        try:
+            # 任意HTTP响应都说明服务在线，不带参数的请求会返回400
+            self.http_session.get(TTS_API_URL, timeout=(2, 5))
+            print("信息| TTS服务可访问")
+            return True
+        except Exception as e:
+            print(f"警告| TTS服务无法访问，请确认GPT-SoVITS已启动: {str(e)}")
+            return False
+
     def generate_opening_line(self):
         """将测试回复作为开场白"""
         if not self.use_chatai:
@@ -650,75 +3055,160 @@ class BackendService:
             parts = last_message_content.split("】\n\n", 1)
             if len(parts) > 1:
                 # 返回最终回复部分
-                return parts[1]
+                return self.display_reply(parts[1])
         
         # 如果不包含思维链格式，直接返回原内容
-        return last_message_content
+        return self.display_reply(last_message_content)
+
+    def format_related_memories(self, memories):
+        """格式化相关记忆为系统指令"""
+        if not memories:
+            return ""
+        related_text = "<OOC：相关记忆(和现在有关的记忆)"
+        for memory in memories:
+            related_text += f"\n{memory['date']}: {memory['content']}"
+        return related_text + ">"
+
+    def build_request_messages(self):
+        """构造请求消息列表"""
+        # 固定系统提示词、记忆和历史保持不变，作为可缓存的前缀
+        messages = [{"role": msg["role"], "content": msg["content"]} for msg in self.backend_history]
+
+        # 每轮变化的"相关记忆"放在末尾的用户消息中，不写入后端历史
+        related_text = self.format_related_memories(self.related_memories)
+        if related_text and messages[-1]["role"] == "user":
+            messages[-1]["content"] += f"\n{related_text}"
+        return messages
+
+    def estimate_text_tokens(self, text):
+        """估算文本Token数"""
+        # 经验值：1个中日文字符约0.6个Token，1个英文字符约0.3个Token
+        cjk_count = len(re.findall(r'[\u3000-\u30ff\u4e00-\u9fff\uff00-\uffef]', text))
+        return int(cjk_count * 0.6 + (len(text) - cjk_count) * 0.3) + 4
+
+    def estimate_message_tokens(self, msg):
+        """估算消息Token数，结果缓存在消息上"""
+        content = msg["content"]
+        cached = msg.get("token_estimate")
+        # 内容长度变化(清理思维链、添加时间信息)时重新估算
+        if cached and cached[0] == len(content):
+            return cached[1]
+        tokens = self.estimate_text_tokens(content)
+        msg["token_estimate"] = [len(content), tokens]
+        return tokens
+
+    def trim_backend_history(self):
+        """上下文清理"""
+        # 分离后端历史
+        system_message = self.backend_history[0]
+        dialogue_history = self.backend_history[1:]
 
-    def update_system_prompt_with_memories(self, memories):
-        """更新系统提示词以包含相关记忆"""
-        # 获取包含"你的记忆"的系统提示词
-        system_prompt = self.system_prompt
+        # 为系统提示词、相关记忆和回复预留Token
+        related_text = self.format_related_memories(self.related_memories)
+        reserved_tokens = self.estimate_message_tokens(system_message) + MAX_TOKENS
+        if related_text:
+            reserved_tokens += self.estimate_text_tokens(related_text)
+        available_tokens = (CONTEXT_TOKEN_BUDGET - reserved_tokens) / self.token_scale
 
-        # 添加"相关记忆"
-        if memories:
-            system_prompt += "\n## 相关记忆(和现在有关的记忆)"
-            for memory in memories:
-                system_prompt += f"\n{memory['date']}: {memory['content']}"
+        history_tokens = sum(self.estimate_message_tokens(msg) for msg in dialogue_history)
+        self.last_prompt_estimate = reserved_tokens - MAX_TOKENS + history_tokens
+        if history_tokens <= available_tokens:
+            return
 
-        return system_prompt
+        # 超出预算时整块移除，避免每轮都改变前缀
+        target_tokens = available_tokens - HISTORY_EVICT_TOKENS
+        removed_messages = []
+        while len(dialogue_history) > 1 and (
+            history_tokens > target_tokens or dialogue_history[0]["role"] != "user"
+        ):
+            msg = dialogue_history.pop(0)
+            history_tokens -= self.estimate_message_tokens(msg)
+            removed_messages.append(msg)
 
-    def call_chatai(self):
-        """请求ChatAI"""
-        # 调用`更新系统提示词以包含相关记忆`
-        if self.backend_history and self.backend_history[0]["role"] == "system":
-            self.backend_history[0]["content"] = self.update_system_prompt_with_memories(self.related_memories)
+        print(f"信息| 上下文已超出 {CONTEXT_TOKEN_BUDGET} Token预算，移除最早的 {len(removed_messages)} 条对话：")
+        for msg in removed_messages:
+            print(f"      - {msg['role']}: {msg['content'][:30]}……")
 
+        # 重建后端历史并更新
+        self.backend_history = [system_message] + dialogue_history
+        self.last_prompt_estimate = reserved_tokens - MAX_TOKENS + history_tokens
+
+        # 前缀已经变化，调用`会话增量总结`，移出的对话总结后以会话摘要形式进入系统提示词
+        # 后端长历史末尾的对话与后端历史一致，移出部分在后端长历史中结束于剩余对话之前
+        evicted_end = max(len(self.backend_long_history) - len(dialogue_history), 0)
+        self.rolling_summary.on_evicted(removed_messages, evicted_end)
+        self.refresh_system_prompt()
+
+    def record_usage(self, usage):
+        """记录Token用量"""
+        # 用实际的输入Token数校准估算值
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        if prompt_tokens and self.last_prompt_estimate:
+            ratio = prompt_tokens / self.last_prompt_estimate
+            self.token_scale = min(max(self.token_scale * 0.8 + ratio * 0.2, 0.5), 2.0)
+
+        # 调用`记录上下文缓存命中情况`
+        self.record_cache_usage(usage)
+
+    def record_cache_usage(self, usage):
+        """记录上下文缓存命中情况"""
+        hit_tokens = getattr(usage, "prompt_cache_hit_tokens", None)
+        miss_tokens = getattr(usage, "prompt_cache_miss_tokens", None)
+        if hit_tokens is None or miss_tokens is None:
+            return
+
+        self.cache_hit_tokens += hit_tokens
+        self.cache_miss_tokens += miss_tokens
+        total_tokens = self.cache_hit_tokens + self.cache_miss_tokens
+        hit_rate = self.cache_hit_tokens / total_tokens * 100 if total_tokens else 0
+        print(f"信息| 缓存命中: {hit_tokens} | 未命中: {miss_tokens} | 本次会话命中率: {hit_rate:.1f}%")
+
+    def call_chatai(self, on_delta=None):
+        """请求ChatAI"""
         # 调用`清理历史中的思维链`
         self.clean_old_reasoning_content()
 
+        # 调用`更新系统提示词`，记忆变化或跨天时才重新渲染
+        self.refresh_system_prompt()
+
+        # 调用`上下文清理`
+        self.trim_backend_history()
+
         # 打印后端历史
         print("信息| 后端历史:")
         for i, msg in enumerate(self.backend_history):
             print(f"      [{i}] {msg['role']}: {msg['content'][:9999]}{'...' if len(msg['content']) > 9999 else ''}")
-        
-        # 上下文清理
-        # 分离后端历史
-        system_message = self.backend_history[0]
-        dialogue_history = self.backend_history[1:]
 
-        while len(dialogue_history) > MAX_HISTORY_MESSAGES - 1:  # -1 为系统提示词保留位置
-            if len(dialogue_history) >= 2:  
-                removed_messages = dialogue_history[:2]
-                dialogue_history = dialogue_history[2:]
-                print(f"信息| 条数已达 {MAX_HISTORY_MESSAGES}，移除最早一轮对话：")
-                for msg in removed_messages:
-                    print(f"      - {msg['role']}: {msg['content'][:30]}……")
-            else:
-                break
+        # 调用`构造请求消息列表`
+        messages = self.build_request_messages()
 
-        # 重建后端历史并更新
-        self.backend_history = [system_message] + dialogue_history
+        # 记录首字时间
+        def traced_delta(kind, text):
+            self.tracer.mark("first_token")
+            if on_delta:
+                on_delta(kind, text)
 
         try:
-            response = self.client.chat.completions.create(
-                model=MODEL,
-                messages=self.backend_history,
-                temperature=1.2,
-                max_tokens=8192
-            )
+            # 调用`请求ChatAI服务商`
+            with self.tracer.span("chatai"):
+                content, reasoning_content, usage = self.provider_registry.chat(
+                    messages,
+                    traced_delta,
+                    temperature=1.2,
+                    max_tokens=MAX_TOKENS
+                )
 
-            # 获取AI回复和Token
-            content = response.choices[0].message.content
-            
-            # 获取思维链内容，如果不存在则为空值
-            reasoning_content = getattr(response.choices[0].message, 'reasoning_content', '')
-            
-            tokens_used = response.usage.total_tokens
+            # 获取Token
+            tokens_used = None
+            if usage:
+                tokens_used = usage.total_tokens
+                self.record_usage(usage)
             return content, reasoning_content, tokens_used
         
         except Exception as e:
             print(f"错误| ChatAI API异常: {str(e)}")
+            # 调用`取消语音流`，不再播放已收到的部分回复
+            self.cancel_pending_speech()
             return "欸……连接不上我的大脑😵", "", None
         
     def clean_old_reasoning_content(self):
@@ -789,13 +3279,8 @@ class BackendService:
             # 获取当前时间
             time_info = f"<OOC：{self.get_timeinfo_2()}>"
             
-            # 读取短期记忆文件
-            file_path = "short_term_memory.json"
-            if not os.path.exists(file_path):
-                return
-                
-            with open(file_path, 'r', encoding='utf-8') as file:
-                short_term_memory = json.load(file)
+            # 读取短期记忆日志中最近的消息
+            short_term_memory = self.short_term_log.tail(2)
             
             # 确保有足够的历史消息
             if len(short_term_memory) >= 2:
@@ -804,12 +3289,9 @@ class BackendService:
                 
                 # 检查是否已经包含时间信息，避免重复添加
                 if "<OOC：" not in second_last_msg["content"]:
-                    # 在消息内容末尾添加时间信息
+                    # 在消息内容末尾添加时间信息，日志中只追加一条编辑记录
                     second_last_msg["content"] += f" {time_info}"
-                    
-                    # 保存修改后的短期记忆
-                    with open(file_path, 'w', encoding='utf-8') as file:
-                        json.dump(short_term_memory, file, ensure_ascii=False, indent=4)
+                    self.short_term_log.edit(second_last_msg)
                     
                     print(f"信息| 已在短期记忆中添加时间信息: {time_info}")
                     
@@ -834,45 +3316,81 @@ class BackendService:
         if not USE_TRANSLATION:
             # 不使用翻译时，直接返回输入文本
             return text
-        
-        # 使用翻译时，调用火山翻译API
+
+        # 分句后调用`批量中译日`，任一句翻译失败时返回None
+        sentences = [piece.strip() for piece in SentenceSplitter.SENTENCE_PATTERN.findall(text) if piece.strip()] or [text]
+        translations = self.translate_sentences(sentences)
+        if not all(translations):
+            return None
+        return "".join(translations)
+
+    def translate_sentences(self, sentences):
+        """批量中译日，返回与输入顺序一致的列表，失败的句子为None"""
+        if not USE_TRANSLATION:
+            return list(sentences)
+
+        results = [None] * len(sentences)
+
+        # 调用`翻译缓存`，命中的句子不再请求翻译API
+        missing = {}
+        for i, sentence in enumerate(sentences):
+            cached = self.translation_cache.get(sentence, "ja") if self.translation_cache is not None else None
+            if cached is not None:
+                results[i] = cached
+            else:
+                missing.setdefault(sentence, []).append(i)
+        if self.translation_cache is not None and len(missing) < len(sentences):
+            print(f"信息| 翻译缓存命中 | {self.translation_cache.describe()}")
+        if not missing:
+            return results
+
+        # 未命中的句子按句数和字数分组，每组一次请求
+        batches = [[]]
+        batch_chars = 0
+        for sentence in missing:
+            if batches[-1] and (len(batches[-1]) >= TRANSLATE_BATCH_SIZE or batch_chars + len(sentence) > TRANSLATE_BATCH_CHARS):
+                batches.append([])
+                batch_chars = 0
+            batches[-1].append(sentence)
+            batch_chars += len(sentence)
+
+        # 只有一组时直接请求，多组时限制并发数并行请求
+        if len(batches) == 1:
+            translated = [self.request_translation(batches[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(TRANSLATE_MAX_WORKERS, len(batches))) as executor:
+                translated = list(executor.map(self.request_translation, batches))
+
+        for batch, translations in zip(batches, translated):
+            for sentence, translation in zip(batch, translations):
+                if not translation:
+                    continue
+                if self.translation_cache is not None:
+                    self.translation_cache.put(sentence, "ja", translation)
+                for i in missing[sentence]:
+                    results[i] = translation
+        return results
+
+    def request_translation(self, text_list):
+        """发送一次火山翻译请求，返回与"text_list"顺序一致的列表"""
         def translate_request():
-            # 服务信息
-            service_info = ServiceInfo(
-                'translate.volcengineapi.com',
-                {'Content-Type': 'application/json'},
-                Credentials(self.VOLC_ACCESS_KEY, self.VOLC_SECRET_KEY, 'translate', 'cn-north-1'),
-                5,
-                5
-            )
-            
-            # API信息
-            api_info = {
-                'translate': ApiInfo(
-                    'POST', 
-                    '/', 
-                    {'Action': 'TranslateText', 'Version': '2020-06-01'},
-                    {}, 
-                    {}
-                )
-            }
-            
-            # 创建服务实例并发送请求
-            service = Service(service_info, api_info)
+            # 调用`获取火山翻译服务实例`并发送请求
+            service = self.get_translate_service()
             body = {
                 'TargetLanguage': 'ja',  # 目标语言
-                'TextList': [text],
+                'TextList': text_list,
                 'SourceLanguage': 'zh'   # 源语言
             }
             
             response = json.loads(service.json('translate', {}, json.dumps(body)))
             
-            # 获取翻译结果
-            if "TranslationList" in response and len(response["TranslationList"]) > 0:
-                return response["TranslationList"][0]["Translation"]
+            # 获取翻译结果，条数与请求不一致时视为异常
+            translation_list = response.get("TranslationList") or []
+            if len(translation_list) == len(text_list):
+                return [item.get("Translation") for item in translation_list]
             else:
                 print(f"错误| 火山翻译API返回异常: {json.dumps(response, indent=2, ensure_ascii=False)}")
-                return None
+                return [None] * len(text_list)
         
         # 错误处理：请求超时
         max_retries = 1  # 最大重试次数
@@ -880,7 +3398,8 @@ class BackendService:
         
         while retry_count <= max_retries:
             try:
-                return translate_request()
+                with self.tracer.span("translate"):
+                    return translate_request()
             except Exception as e:
                 # 判断是否为超时错误
                 is_timeout_error = "Read timed out" in str(e) or "timed out" in str(e).lower()
@@ -893,9 +3412,9 @@ class BackendService:
                 else:
                     print(f"错误| 火山翻译异常: {str(e)}")
                     traceback.print_exc()
-                    return None
+                    return [None] * len(text_list)
         
-        return None
+        return [None] * len(text_list)
 
     def extract_dialogue_content(self, text):
         """提取说话内容"""
@@ -924,15 +3443,28 @@ class BackendService:
         
     def text_to_speech(self, text):
         """TTS和播放"""
+        # 调用`TTS合成`
+        audio = self.synthesize_speech(text)
+        if not audio:
+            return False
+        # 调用`播放音频`
+        return self.play_audio(audio)
+
+    def synthesize_speech(self, text):
+        """TTS合成，返回音频数据"""
         try:
             # 构建请求数据
             request_data = REF_AUDIO_CONFIG.copy()
             request_data["text"] = text
+            if USE_TTS_STREAMING:
+                request_data["streaming_mode"] = True
+                request_data["media_type"] = "wav"
             print(f"信息| TTS文本: {text}")
             print(f"信息|" + "-" * 100)
             
-            # 调用TTS API
-            response = requests.post(TTS_API_URL, json=request_data)
+            # 调用TTS API，流式TTS只等待响应头
+            with self.tracer.span("tts"):
+                response = self.http_session.post(TTS_API_URL, json=request_data, timeout=TTS_TIMEOUT, stream=USE_TTS_STREAMING)
             
             # 检查响应
             if response.status_code != 200:
@@ -942,32 +3474,115 @@ class BackendService:
                     print(f"信息| {json.dumps(error_detail, indent=2, ensure_ascii=False)}")
                 except:
                     print(f"信息| {response.text[:200]}")
-                return False
-            
-            # 保存音频
-            os.makedirs(self.audio_dir, exist_ok=True)
-            timestamp = int(time.time())
-            audio_path = os.path.join(self.audio_dir, f"response_{timestamp}.wav")
-            
-            with open(audio_path, "wb") as f:
-                f.write(response.content)
-            
-            # 播放音频
-            pygame.mixer.music.load(audio_path)
-            pygame.mixer.music.play()
+                return None
+            if USE_TTS_STREAMING:
+                return TTSAudioStream(response)
+            return response.content
             
-            # 等待播放完成
-            while pygame.mixer.music.get_busy():
-                time.sleep(0.1)        
+        except Exception as e:
+            print(f"错误| TTS异常: {str(e)}")
+            traceback.print_exc()
+            return None
+
+    def play_audio(self, audio, cancelled=None):
+        """播放音频，"cancelled"被设置时停止播放"""
+        import pygame
+
+        # 调用`流式播放音频`
+        if isinstance(audio, TTSAudioStream):
+            return self.play_audio_stream(audio, cancelled)
+
+        try:
+            # 调用`调试录音`，由后台线程保存
+            self.audio_recorder.record(audio)
+
+            # 直接从内存播放音频
+            with self.tracer.span("playback"):
+                channel = pygame.mixer.Sound(file=io.BytesIO(audio)).play()
+                self.tracer.mark("first_audio")
+                
+                # 等待播放完成
+                while channel is not None and channel.get_busy():
+                    if cancelled is not None and cancelled.is_set():
+                        channel.stop()
+                        return False
+                    time.sleep(0.1)        
             return True
             
         except Exception as e:
-            print(f"错误| TTS异常: {str(e)}")
+            print(f"错误| 播放异常: {str(e)}")
             traceback.print_exc()
             return False
 
-    def process_user_message(self, user_input, play_tts=True):
+    def play_audio_stream(self, stream, cancelled=None):
+        """流式播放音频，缓冲"TTS_JITTER_BUFFER"秒后开始播放，之后的分块依次排入声道"""
+        import pygame
+
+        try:
+            stream.format_ready.wait()
+            if stream.error is not None:
+                return False
+
+            # 调用`调试录音`，由后台线程等待接收完成后保存
+            self.audio_recorder.record(stream)
+
+            # 混音器格式与音频不一致时重新初始化
+            mixer_format = (stream.sample_rate, -8 * stream.sample_width, stream.channels)
+            if pygame.mixer.get_init() != mixer_format:
+                pygame.mixer.quit()
+                pygame.mixer.init(frequency=stream.sample_rate, size=-8 * stream.sample_width, channels=stream.channels)
+
+            with self.tracer.span("playback"):
+                # 抖动缓冲：开始播放前先积累一段音频
+                jitter_bytes = int(stream.bytes_per_second() * TTS_JITTER_BUFFER)
+                pcm = stream.read(jitter_bytes)
+                if pcm is None:
+                    return False
+                channel = pygame.mixer.Sound(buffer=pcm).play()
+                self.tracer.mark("first_audio")
+
+                # 声道的等待队列空出时，把已收到的音频合并为一段排入
+                while True:
+                    if cancelled is not None and cancelled.is_set():
+                        channel.stop()
+                        return False
+                    if channel.get_queue() is not None:
+                        time.sleep(0.01)
+                        continue
+                    busy = channel.get_busy()
+                    # 缓冲耗尽导致播放中断时，重新积累一段音频再播放
+                    pcm = stream.read(jitter_bytes, block=not busy)
+                    if pcm is None:
+                        if stream.exhausted:
+                            break
+                        time.sleep(0.01)
+                        continue
+                    if busy:
+                        channel.queue(pygame.mixer.Sound(buffer=pcm))
+                    else:
+                        channel = pygame.mixer.Sound(buffer=pcm).play()
+
+                # 等待播放完成
+                while channel.get_busy():
+                    if cancelled is not None and cancelled.is_set():
+                        channel.stop()
+                        return False
+                    time.sleep(0.05)
+            return True
+
+        except Exception as e:
+            print(f"错误| 播放异常: {str(e)}")
+            traceback.print_exc()
+            return False
+
+    def process_user_message(self, user_input, play_tts=True, on_delta=None):
         """处理用户消息"""
+        # 调用`取消语音流`，上一次未播放的语音流不再播放
+        self.cancel_pending_speech()
+
+        self.tracer.begin_turn("dialogue")
+        memory_span = self.tracer.start("memory_match")
+
         # 在用户输入前，先匹配上一次的AI回复
         ai_matched_memories = []
         if self.last_ai_response:
@@ -976,123 +3591,14 @@ class BackendService:
         # 匹配当前用户输入
         user_matched_memories = self.match_essences_with_text(user_input)
 
-        # 合并并去重，根据日期去重
-        all_matched_memories = ai_matched_memories + user_matched_memories
-        unique_memories = []
-        seen_dates = set()
-
-        for memory in all_matched_memories:
-            if memory["date"] not in seen_dates:
-                seen_dates.add(memory["date"])
-                unique_memories.append(memory)
+        # 混合检索：语义检索找出关键词未命中的日记
+        semantic_memories = self.search_semantic_memories(user_input)
 
-        # 按关键词分组
-        memories_by_essence = {}
-        for memory in unique_memories:
-            essence = memory["matched_essence"]
-            if essence not in memories_by_essence:
-                memories_by_essence[essence] = []
-            memories_by_essence[essence].append(memory)
-
-        # 获取所有关键词
-        essences = list(memories_by_essence.keys())
-        num_essences = len(essences)
-
-        selected_memories = []
-
-        # 具体匹配细则
-        if num_essences == 0:
-            # 没有匹配到任何关键词
-            self.related_memories = []
-        elif num_essences == 1:
-            # 1个关键词时，取3条固定+2条随机，共5条
-            memories = memories_by_essence[essences[0]]
-            if len(memories) <= 3:
-                selected_memories = memories
-            else:
-                # 前3条固定
-                selected_memories = memories[:3]
-                # 从剩余中随机取2条
-                remaining = memories[3:]
-                if len(remaining) <= 2:
-                    selected_memories.extend(remaining)
-                else:
-                    selected_memories.extend(random.sample(remaining, 2))
-        elif num_essences == 2:
-            # 2个关键词时，每个关键词取1条，再从这关键词池中取3条随机的，共5条
-            for essence in essences:
-                if memories_by_essence[essence]:
-                    selected_memories.append(memories_by_essence[essence][0])
-            
-            # 收集所有记忆（排除已选的）
-            all_memories = []
-            for essence in essences:
-                all_memories.extend(memories_by_essence[essence])
-            
-            # 移除已选的
-            remaining_memories = [m for m in all_memories if m not in selected_memories]
-            
-            # 随机选择3条
-            if len(remaining_memories) <= 3:
-                selected_memories.extend(remaining_memories)
-            else:
-                selected_memories.extend(random.sample(remaining_memories, 3))
-        elif num_essences == 3:
-            # 3个关键词时，每个关键词取1条，再从这关键词池中取2条随机的，共5条
-            for essence in essences:
-                if memories_by_essence[essence]:
-                    selected_memories.append(memories_by_essence[essence][0])
-            
-            # 收集所有记忆（排除已选的）
-            all_memories = []
-            for essence in essences:
-                all_memories.extend(memories_by_essence[essence])
-            
-            # 移除已选的
-            remaining_memories = [m for m in all_memories if m not in selected_memories]
-            
-            # 随机选择2条
-            if len(remaining_memories) <= 2:
-                selected_memories.extend(remaining_memories)
-            else:
-                selected_memories.extend(random.sample(remaining_memories, 2))
-        elif num_essences == 4:
-            # 4个关键词时，每个关键词取1条，再从这关键词池中取1条随机的，共5条
-            for essence in essences:
-                if memories_by_essence[essence]:
-                    selected_memories.append(memories_by_essence[essence][0])
-            
-            # 收集所有记忆（排除已选的）
-            all_memories = []
-            for essence in essences:
-                all_memories.extend(memories_by_essence[essence])
-            
-            # 移除已选的
-            remaining_memories = [m for m in all_memories if m not in selected_memories]
-            
-            # 随机选择1条
-            if remaining_memories:
-                selected_memories.append(random.choice(remaining_memories))
-        elif num_essences == 5:
-            # 5个关键词时，每个关键词取1条，不取随机，共5条
-            for essence in essences:
-                if memories_by_essence[essence]:
-                    selected_memories.append(memories_by_essence[essence][0])
-        else:
-            # 5个以上的关键词时，从所有的关键词池中随机取5条，共5条
-            # 收集所有记忆的第一条
-            all_first_memories = []
-            for essence in essences:
-                if memories_by_essence[essence]:
-                    all_first_memories.append(memories_by_essence[essence][0])
-            
-            # 随机选择5条
-            if len(all_first_memories) <= 5:
-                selected_memories = all_first_memories
-            else:
-                selected_memories = random.sample(all_first_memories, 5)
+        # 调用`选择相关记忆`，所有候选统一打分后按预算选择
+        selected_memories = self.select_related_memories(ai_matched_memories, user_matched_memories, semantic_memories)
 
         self.related_memories = selected_memories
+        self.tracer.end(memory_span)
 
         # 添加用户消息到后端历史和后端长历史
         self.backend_history.append({"role": "user", "content": user_input})
@@ -1103,28 +3609,36 @@ class BackendService:
             print(f"信息| AI回复匹配到的相关记忆: {[m['matched_essence'] for m in ai_matched_memories]}")
         if user_matched_memories:
             print(f"信息| 用户输入匹配到的相关记忆: {[m['matched_essence'] for m in user_matched_memories]}")
+        if semantic_memories:
+            print(f"信息| 语义检索匹配到的相关记忆: {[(m['date'], round(m['score'], 3)) for m in semantic_memories]}")
         
         # 打印最终选择的记忆
         if self.related_memories:
-            print(f"信息| 最终选择的记忆 ({len(self.related_memories)}条): {[m['matched_essence'] for m in self.related_memories]}")
+            print(f"信息| 最终选择的记忆 ({len(self.related_memories)}条): {[m['matched_essence'] or m['date'] for m in self.related_memories]}")
         else:
             print("信息| 未匹配到相关记忆或相关记忆已在'你的记忆'部分")
 
         # 调用`请求ChatAI`并获取回复
         tokens_used = None
         if self.use_chatai:
+            # 流式回复时，边接收回复边进行分句翻译、TTS和播放
+            if USE_STREAM and USE_SPEECH_PIPELINE and self.tts_success:
+                self.pending_speech = SpeechStream(self, on_delta)
+                on_delta = self.pending_speech.on_delta
+
             # 调用`请求ChatAI`
-            content, reasoning_content, tokens_used = self.call_chatai()
+            content, reasoning_content, tokens_used = self.call_chatai(on_delta)
 
             # 清理AI回复
             content = content.strip()
+            self.last_raw_response = content
             reasoning_content = reasoning_content.strip() if reasoning_content else ""
 
             # 组合思维链和最终回复
             combined_content = f"【{reasoning_content}】\n\n{content}" if reasoning_content else content
 
-            # 保存当前AI回复，用于下一次匹配（使用原始回复，不包含思维链）
-            self.last_ai_response = content
+            # 保存当前AI回复，用于下一次匹配（使用原始回复，不包含思维链和日语）
+            self.last_ai_response = self.display_reply(content)
             
             # 添加组合后的AI回复到后端历史和后端长历史
             self.backend_history.append({"role": "assistant", "content": combined_content})
@@ -1139,11 +3653,10 @@ class BackendService:
                 print(f"信息| 退出标记检测结果: {'🤐' in content}")
                 should_exit = "🤐" in content
 
-            # 保存短期记忆
+            # 保存短期记忆，只追加本轮新消息，由后台线程写入
             try:
-                file_path = "short_term_memory.json"
-                with open(file_path, 'w', encoding='utf-8') as file:
-                    json.dump(self.backend_history, file, ensure_ascii=False, indent=4)
+                with self.tracer.span("save_short_term"):
+                    self.short_term_log.append_new(self.backend_history)
             except Exception as e:
                 print(f"警告| 保存`backend_history`到文件失败: {str(e)}")
 
@@ -1152,7 +3665,16 @@ class BackendService:
                 self.handle_exit_detection(content)  # 使用原始回复
 
             # 调用`保存长期记忆`
-            self.save_long_term_memory()
+            with self.tracer.span("save_long_term"):
+                self.save_long_term_memory()
+
+            # 调用`会话增量总结`，重试失败的总结，退出时不再需要
+            if not should_exit:
+                self.rolling_summary.on_turn()
+
+            # 不播放语音时本轮到此结束
+            if not self.tts_success:
+                self.tracer.end_turn()
 
             if reasoning_content:
                 print(f"信息| AI思维链：\n{reasoning_content}")
@@ -1160,8 +3682,8 @@ class BackendService:
 
             print(f"信息| Token: {tokens_used} | 请求条数：{len(self.backend_history)} | 总结条数：{len(self.backend_long_history)}")
             
-            # 返回原始回复给前端，确保UI不显示思维链
-            return content, should_exit
+            # 返回原始回复给前端，确保UI不显示思维链和日语
+            return self.display_reply(content), should_exit
         else:
             ai_response = f"ChatAI不可用 {user_input} "
             tokens_used = 0
@@ -1176,12 +3698,22 @@ class BackendService:
         # 使用后端长历史
         dialogue_history = self.backend_long_history
         print(f"信息| 后端长历史总条数: {len(dialogue_history)}")
+
+        # 等待进行中的增量总结，已总结的部分用会话摘要代替，只发送之后的对话
+        self.rolling_summary.wait(LLM_TIMEOUT)
+        if self.rolling_summary.summary:
+            dialogue_history = self.rolling_summary.unsummarized(dialogue_history)
+            print(f"信息| 使用会话摘要和{len(dialogue_history)}条未总结的消息")
         
         if len(dialogue_history) > SUMMARY_HISTORY_LENGTH:
             dialogue_history = dialogue_history[-SUMMARY_HISTORY_LENGTH:]
             print(f"信息| 截取最后{SUMMARY_HISTORY_LENGTH}条用于总结")
         else:
             print(f"信息| 使用全部{len(dialogue_history)}条用于总结")
+
+        if self.rolling_summary.summary:
+            summary_note = {"role": "user", "content": f"<OOC：本次会话早些时候的对话摘要：\n{self.rolling_summary.summary}>"}
+            dialogue_history = [summary_note] + dialogue_history
         
         # 返回用于对话总结的历史
         summary_history = [{"role": "system", "content": summary_system_prompt}] + dialogue_history
@@ -1249,13 +3781,8 @@ class BackendService:
     def remove_summary_from_short_term_memory(self):
         """从短期记忆中删除总结相关的消息"""
         try:
-            file_path = "short_term_memory.json"
-            if not os.path.exists(file_path):
-                return
-                
-            # 读取短期记忆
-            with open(file_path, 'r', encoding='utf-8') as file:
-                short_term_memory = json.load(file)
+            # 读取短期记忆日志中最近的消息
+            short_term_memory = self.short_term_log.tail(2)
             
             # 查找并删除总结相关的消息
             if len(short_term_memory) >= 2:
@@ -1276,11 +3803,9 @@ class BackendService:
                 
                 # 移除总结消息
                 if summary_request_found and summary_response_found:
-                    short_term_memory = short_term_memory[:-2]
-                    
-                    # 保存修改后的短期记忆
-                    with open(file_path, 'w', encoding='utf-8') as file:
-                        json.dump(short_term_memory, file, ensure_ascii=False, indent=4)
+                    # 日志中追加删除记录
+                    for msg in last_two_messages:
+                        self.short_term_log.drop(msg)
                     print("信息| 已从短期记忆中删除总结相关的消息")
         except Exception as e:
             print(f"警告| 从短期记忆中删除总结消息失败: {str(e)}")
@@ -1288,17 +3813,17 @@ class BackendService:
     def call_chatai_for_summary(self, messages):
         """请求总结"""
         try:
-            response = self.client.chat.completions.create(
-                model=MODEL,
-                messages=messages,
+            ai_response, _, usage = self.provider_registry.chat(
+                messages,
+                stream=False,
+                hedge=False,
                 temperature=0.8,
                 max_tokens=8192,
                 response_format={"type": "json_object"}
             )
 
             # 获取AI回复和Token
-            ai_response = response.choices[0].message.content
-            tokens_used = response.usage.total_tokens
+            tokens_used = usage.total_tokens if usage else None
             return ai_response, tokens_used
         
         except Exception as e:
@@ -1475,15 +4000,33 @@ class BackendService:
             print(f"错误| 获取总结失败: {str(e)}")
             return None
 
+    def display_reply(self, content):
+        """去除双语回复中的日语，用于显示"""
+        if not (USE_BILINGUAL_REPLY and USE_TRANSLATION):
+            return content
+        return BilingualReplySplitter.display_text(content).strip()
+
     def process_ai_response(self, ai_response):
         """处理AI回复流程"""
+        # 前端传入的是去除日语后的回复，取回原始回复
+        if self.last_raw_response and ai_response == self.display_reply(self.last_raw_response):
+            ai_response = self.last_raw_response
+
+        if USE_SPEECH_PIPELINE:
+            # 调用`分句流水线播放`
+            self.speak_with_pipeline(ai_response)
+            self.tracer.end_turn()
+            return "🤐" in ai_response
+
         # 调用`提取说话内容`处理
-        dialogue_content = self.extract_dialogue_content(ai_response)
+        dialogue_content = self.extract_dialogue_content(self.display_reply(ai_response))
         
-        # 调用`中译日`处理
+        # 调用`中译日`处理，双语回复时直接使用回复中的日语
         japanese_text = None
         try:
-            if dialogue_content:
+            if USE_BILINGUAL_REPLY and USE_TRANSLATION:
+                japanese_text = self.bilingual_to_japanese(ai_response)
+            elif dialogue_content:
                 japanese_text = self.chinese_to_translate_japanese(dialogue_content)
         except Exception as e:
             print(f"错误| 翻译失败: {str(e)}")
@@ -1497,10 +4040,48 @@ class BackendService:
         elif dialogue_content:
             print("警告| 翻译错误，使用原文TTS")
             self.text_to_speech(dialogue_content)
+        self.tracer.end_turn()
         
         # 只返回是否检测到退出标记，不处理退出逻辑
         return "🤐" in ai_response
 
+    def bilingual_to_japanese(self, ai_response):
+        """取出双语回复中的日语，缺少日语的句子调用`批量中译日`，任一句失败时返回None"""
+        splitter = BilingualReplySplitter(self.extract_dialogue_content)
+        items = splitter.push(ai_response) + splitter.flush()
+        texts = [japanese for _, japanese in items]
+        missing = [i for i, japanese in enumerate(texts) if japanese is None]
+        if missing:
+            for i, translation in zip(missing, self.translate_sentences([items[i][0] for i in missing])):
+                texts[i] = translation
+        if not texts or not all(texts):
+            return None
+        return "".join(texts)
+
+    def cancel_pending_speech(self):
+        """取消语音流"""
+        speech, self.pending_speech = self.pending_speech, None
+        if speech is not None:
+            speech.cancel()
+
+    def speak_with_pipeline(self, ai_response):
+        """分句流水线播放"""
+        # 流式回复时流水线已在运行，只需送入还未收到的部分并结束输入
+        speech = self.pending_speech
+        self.pending_speech = None
+        received = speech.received.strip() if speech is not None else None
+        if received is not None and ai_response.strip().startswith(received):
+            speech.push(ai_response.strip()[len(received):])
+        else:
+            # 回复与已播放的内容不一致时，取消原来的语音流并从头播放
+            if speech is not None:
+                speech.cancel()
+            speech = SpeechStream(self)
+            speech.push(ai_response)
+
+        speech.finish()
+        return speech.pipeline.wait()
+
     def get_opening_line(self):
         """获取开场白"""
         return self.opening_line
@@ -1513,17 +4094,17 @@ class BackendService:
         while len(self.backend_history) > 1:  # 保留系统消息
             last_message = self.backend_history[-1]
             if last_message["role"] == "assistant":
-                # 删除AI回复
-                self.backend_history.pop()
+                # 删除AI回复，短期记忆日志中追加删除记录
+                self.short_term_log.drop(self.backend_history.pop())
                 deleted_count += 1
                 # 继续检查前一条是否是用户消息
                 if len(self.backend_history) > 1 and self.backend_history[-1]["role"] == "user":
-                    self.backend_history.pop()
+                    self.short_term_log.drop(self.backend_history.pop())
                     deleted_count += 1
                 break
             elif last_message["role"] == "user":
                 # 如果最后一条是用户消息，也删除
-                self.backend_history.pop()
+                self.short_term_log.drop(self.backend_history.pop())
                 deleted_count += 1
                 break
             else:
@@ -1546,6 +4127,9 @@ class BackendService:
             else:
                 break
         
+        # 会话摘要不再包含被删除位置之后的对话
+        self.rolling_summary.truncate(len(self.backend_long_history))
+        
         print(f"信息| 已删除 {deleted_count} 条消息")
         return deleted_count
 
@@ -1682,7 +4266,8 @@ class BlurredBackgroundWidget(QWidget):
                     image_path = path
                     break
             
-            if image_path and HAS_PIL:
+            Image, ImageFilter = import_pil()
+            if image_path and Image is not None:
                 # 使用PIL加载并处理图片
                 image = Image.open(image_path)
                 # 调整图片大小为窗口大小
@@ -1704,7 +4289,8 @@ class BlurredBackgroundWidget(QWidget):
     
     def create_white_background(self):
         """创建纯白色毛玻璃背景"""
-        if HAS_PIL:
+        Image, ImageFilter = import_pil()
+        if Image is not None:
             # 创建白色图片并应用模糊
             white_image = Image.new('RGB', (540, 960), color='white')
             blurred_image = white_image.filter(ImageFilter.GaussianBlur(radius=5))
@@ -1986,15 +4572,25 @@ class ChatWindow(QMainWindow):
             self.frontend_history = []
 
         self.pending_exit = False
+
+        # 初始化流式回复相关变量
+        self.stream_bubble = None
+        self.stream_content = ""
+        self.stream_dirty = False
+        self.stream_timer = QTimer(self)
+        self.stream_timer.setInterval(STREAM_REPAINT_INTERVAL)
+        self.stream_timer.timeout.connect(self.flush_stream_bubble)
         
         # 初始化工作线程相关变量
         self.ai_thread = None
         self.ai_worker = None
         self.play_thread = None
         self.play_worker = None
+        self.startup_thread = None
+        self.startup_worker = None
         
         if hasattr(self, 'backend_service'):
-            # 遍历后端历史显示到前端
+            # 遍历后端历史显示到前端，不等待后台预热
             for msg in self.backend_service.backend_history:
                 role = msg.get("role")
                 content = msg.get("content", "")
@@ -2016,32 +4612,27 @@ class ChatWindow(QMainWindow):
                         if len(parts) > 1:
                             display_content = parts[1]  # 只取最终回复部分
                     
-                    is_opening_line = (msg == self.backend_service.backend_history[-1])
-                    if not is_opening_line:
-                        self.add_ai_message(display_content)
+                    self.add_ai_message(display_content)
             
             # 在开场白之前添加欢迎消息
             self.add_system_message("以下是新的消息")
             
-            # 添加AI开场白并播放
-            opening_line = self.backend_service.get_opening_line()
-            self.add_ai_message(opening_line)
-            
             self.set_ui_busy(True)
 
-            # 创建播放开场白的工作线程
-            self.play_worker = PlayWorker(self.backend_service, opening_line)
-            self.play_thread = QThread()
-            self.play_worker.moveToThread(self.play_thread)
+            # 创建后台预热的工作线程，开场白流式显示
+            self.startup_worker = StartupWorker(self.backend_service)
+            self.startup_thread = QThread()
+            self.startup_worker.moveToThread(self.startup_thread)
 
             # 连接信号
-            self.play_thread.started.connect(self.play_worker.run)
-            self.play_worker.play_finished.connect(self.handle_play_finished)
-            self.play_worker.play_finished.connect(self.play_thread.quit)
-            self.play_thread.finished.connect(self.play_thread.deleteLater)
+            self.startup_thread.started.connect(self.startup_worker.run)
+            self.startup_worker.delta_received.connect(self.handle_ai_delta)
+            self.startup_worker.warmup_finished.connect(self.handle_warmup_finished)
+            self.startup_worker.warmup_finished.connect(self.startup_thread.quit)
+            self.startup_thread.finished.connect(self.startup_thread.deleteLater)
 
             # 启动线程
-            self.play_thread.start()
+            self.startup_thread.start()
 
             # 延迟调用滚动到底部
             QTimer.singleShot(100, self.scroll_to_bottom)
@@ -2049,6 +4640,15 @@ class ChatWindow(QMainWindow):
         # 设置焦点到输入框
         self.input_field.setFocus()
 
+    def handle_warmup_finished(self, opening_line):
+        """处理后台预热完成"""
+        # 流式回复已创建气泡时更新为开场白，否则调用`添加AI消息`
+        if self.finish_stream_bubble(opening_line) is None:
+            self.add_ai_message(opening_line)
+
+        # 播放开场白
+        self._start_play_thread(opening_line, self.handle_play_finished)
+
     def delete_last_conversation(self):
         """删除最后一轮对话"""
         if self.ui_busy:
@@ -2188,6 +4788,7 @@ class ChatWindow(QMainWindow):
         
         # 连接信号
         self.ai_thread.started.connect(self.ai_worker.run)
+        self.ai_worker.delta_received.connect(self.handle_ai_delta)
         self.ai_worker.response_received.connect(self.handle_ai_response)
         self.ai_worker.error_occurred.connect(self.handle_ai_error)
         self.ai_worker.response_received.connect(self.ai_thread.quit)
@@ -2197,10 +4798,44 @@ class ChatWindow(QMainWindow):
         # 启动线程
         self.ai_thread.start()
 
+    def handle_ai_delta(self, kind, text):
+        """处理AI流式回复增量"""
+        # 收到第一个增量时创建AI气泡
+        if self.stream_bubble is None:
+            self.stream_bubble = self.add_ai_message("思考中……" if kind == "reasoning" else "")
+            self.stream_timer.start()
+
+        # 思维链不显示到前端，只累积回复内容
+        if kind == "content":
+            self.stream_content += text
+            self.stream_dirty = True
+
+    def flush_stream_bubble(self):
+        """刷新流式回复气泡，由定时器节流调用"""
+        if self.stream_bubble is None or not self.stream_dirty:
+            return
+        self.stream_dirty = False
+        self.stream_bubble.setText(self.backend_service.display_reply(self.stream_content))
+        # 调用`滚动到底部`
+        self.scroll_to_bottom()
+
+    def finish_stream_bubble(self, final_text=None):
+        """结束流式回复并返回气泡"""
+        self.stream_timer.stop()
+        bubble = self.stream_bubble
+        if bubble is not None and final_text is not None:
+            bubble.setText(final_text)
+            self.scroll_to_bottom()
+        self.stream_bubble = None
+        self.stream_content = ""
+        self.stream_dirty = False
+        return bubble
+
     def handle_ai_response(self, ai_response, should_exit):
         """处理AI回复"""
-        # 调用`添加AI消息`
-        self.add_ai_message(ai_response)
+        # 流式回复已创建气泡时更新为最终回复，否则调用`添加AI消息`
+        if self.finish_stream_bubble(ai_response) is None:
+            self.add_ai_message(ai_response)
         
         # 添加到前端历史
         self.frontend_history.append({
@@ -2233,6 +4868,9 @@ class ChatWindow(QMainWindow):
 
     def handle_ai_error(self, error_msg):
         """处理AI请求错误"""
+        self.finish_stream_bubble()
+        # 调用`取消语音流`，不再播放出错前收到的部分回复
+        self.backend_service.cancel_pending_speech()
         self.add_system_message(error_msg)
         # 调用`设置界面按钮状态`
         self.set_ui_busy(False)
@@ -2303,6 +4941,7 @@ class ChatWindow(QMainWindow):
         
         # 调用`滚动到底部`
         self.scroll_to_bottom()
+        return bubble
 
     def add_system_message(self, message):
         """添加系统消息"""
@@ -2345,12 +4984,15 @@ class ChatWindow(QMainWindow):
         # 保留AI开场白
         if hasattr(self, 'backend_service'):
             opening_line = self.backend_service.get_opening_line()
-            self.add_ai_message(opening_line)
+            if opening_line:
+                self.add_ai_message(opening_line)
 
 class AIWorker(QObject):
     """处理AI请求的工作线程类"""
     # AI回复信号和退出标志
     response_received = pyqtSignal(str, bool)
+    # 流式回复增量信号：类型("reasoning"/"content")和增量文本
+    delta_received = pyqtSignal(str, str)
     # 错误信号
     error_occurred = pyqtSignal(str)
 
@@ -2363,13 +5005,36 @@ class AIWorker(QObject):
         """在子线程中执行AI请求"""
         try:
             # 使用后端服务处理用户输入
-            ai_response, should_exit = self.backend_service.process_user_message(self.user_input, play_tts=False)
+            ai_response, should_exit = self.backend_service.process_user_message(
+                self.user_input, play_tts=False, on_delta=self.delta_received.emit
+            )
             self.response_received.emit(ai_response, should_exit)
             
         except Exception as e:
             # 处理异常并发送错误信号
             self.error_occurred.emit(f"错误| AI请求出错: {str(e)}")
 
+class StartupWorker(QObject):
+    """后台预热的工作线程类"""
+    # 开场白流式增量信号
+    delta_received = pyqtSignal(str, str)
+    # 预热完成信号，携带开场白
+    warmup_finished = pyqtSignal(str)
+
+    def __init__(self, backend_service):
+        super().__init__()
+        self.backend_service = backend_service
+
+    def run(self):
+        """在子线程中预热后端服务"""
+        try:
+            opening_line = self.backend_service.warm_up(on_delta=self.delta_received.emit)
+        except Exception as e:
+            print(f"错误| 后台预热失败: {str(e)}")
+            traceback.print_exc()
+            opening_line = "欸……连接不上我的大脑😵"
+        self.warmup_finished.emit(opening_line)
+
 class PlayWorker(QObject):
     """播放TTS的工作线程类"""
     # 播放完成信号
@@ -2390,9 +5055,77 @@ class PlayWorker(QObject):
             print(f"错误| TTS播放失败: {str(e)}")
             self.play_finished.emit()
 
+def measure_import_time():
+    """在子进程中测量模块导入耗时(秒)"""
+    code = "import time; start = time.perf_counter(); import ATRI_Chat; print(time.perf_counter() - start)"
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip())
+    return float(result.stdout.strip().splitlines()[-1])
+
+def report_import_time(top=15):
+    """打印启动耗时报告，按顶层包汇总`python -X importtime`的结果"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import ATRI_Chat"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        print(f"错误| 导入ATRI_Chat失败: {result.stderr.strip().splitlines()[-1] if result.stderr.strip() else result.returncode}")
+        return 1
+
+    # 每行格式：import time: self [us] | cumulative | imported package
+    package_times = {}
+    module_time = None
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, self_time, cumulative, name = [part.strip() for part in line.replace("import time:", "|", 1).split("|")]
+        package = name.split(".")[0]
+        package_times[package] = package_times.get(package, 0) + int(self_time)
+        if name == "ATRI_Chat":
+            module_time = int(cumulative)
+
+    print("信息| 启动耗时报告(按顶层包汇总，单位毫秒):")
+    for package, total in sorted(package_times.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"      {total / 1000:>9.1f}  {package}")
+    if module_time is not None:
+        print(f"信息| ATRI_Chat导入总耗时: {module_time / 1000:.1f} 毫秒")
+    return 0
+
+def check_import_budget():
+    """检查模块导入耗时是否超出预算，超出或导入失败时返回非零退出码"""
+    try:
+        elapsed = measure_import_time()
+    except RuntimeError as e:
+        print(f"错误| 导入ATRI_Chat失败: {str(e)}")
+        return 1
+    if elapsed > IMPORT_TIME_BUDGET:
+        print(f"错误| 模块导入耗时 {elapsed:.3f} 秒，超出预算 {IMPORT_TIME_BUDGET} 秒")
+        return 1
+    print(f"信息| 模块导入耗时 {elapsed:.3f} 秒，预算 {IMPORT_TIME_BUDGET} 秒")
+    return 0
+
 if __name__ == "__main__":
+    # 解析命令行参数，其余参数交给Qt
+    parser = argparse.ArgumentParser(description="ATRI_Chat")
+    parser.add_argument("--import-time", action="store_true", help="打印启动耗时报告")
+    parser.add_argument("--check-import-budget", action="store_true", help="检查模块导入耗时是否超出预算")
+    args, qt_args = parser.parse_known_args()
+
+    if args.import_time:
+        sys.exit(report_import_time())
+    if args.check_import_budget:
+        sys.exit(check_import_budget())
+
     # 创建应用实例
-    app = QApplication(sys.argv)
+    app = QApplication(sys.argv[:1] + qt_args)
     
     # 设置应用样式
     app.setStyle("Fusion")
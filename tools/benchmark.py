@@ -0,0 +1,236 @@
+"""性能基准：Essence匹配、语义检索、相关记忆排序和语音流水线"""
+import os
+import sys
+import time
+import tempfile
+import random
+import argparse
+import threading
+from datetime import date, timedelta
+
+# ATRI_Chat.py位于上一级目录
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ATRI_Chat
+from ATRI_Chat import EssenceIndex, SemanticIndex, MemoryRanker, SpeechPipeline
+
+# 生成随机中文词语所用的常用字
+COMMON_CHARS = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处队南给色光门即保治北造百规热领七海口东导器压志世金增争济阶油思术极交受联什认六共权收证改清己美再采转更单风切打白教速花带安场身车例真务具万每目至达走积示议声报斗完类八离华名确才科张信马节话米整空元况今集温传土许步群广石记需段研界拉林律叫且究观越织装影算低持音众书布复容儿须际商非验连断深难近矿千周委素技备半办青省列习响约支般史感劳便团往酸历市克何除消构府称太准精值号率族维划选标写存候毛亲快效斯院查江型眼王按格养易置派层片始却专状育厂京识适属圆包火住调满县局照参红细引听该铁价严龙飞"
+
+def random_word(rng):
+    """生成2到4个字的随机词语"""
+    return "".join(rng.choice(COMMON_CHARS) for _ in range(rng.randint(2, 4)))
+
+def build_diary(entry_count, vocabulary, rng):
+    """生成指定条数的日记，每条带1到4个Essence"""
+    start = date(2000, 1, 1)
+    diary = []
+    for i in range(entry_count):
+        day = start + timedelta(days=i)
+        diary.append({
+            "date": day.strftime("%Y年%m月%d日"),
+            "content": f"日记内容{i}",
+            "essences": rng.sample(vocabulary, rng.randint(1, 4)),
+        })
+    return diary
+
+def match_essences_naive(diary, text):
+    """原始实现：遍历所有日记和Essence进行子串匹配"""
+    matched = []
+    for entry in diary:
+        for essence in entry.get("essences", []):
+            if isinstance(text, str) and essence.lower() in text.lower():
+                matched.append((entry["date"], essence))
+                break
+    return matched
+
+def time_calls(func, texts, repeat):
+    """返回每次调用的平均耗时(毫秒)"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            func(text)
+    return (time.perf_counter() - start) / (repeat * len(texts)) * 1000
+
+def bench_essence(args):
+    """Essence匹配：原始实现与索引对比"""
+    rng = random.Random(args.seed)
+    vocabulary = list({random_word(rng) for _ in range(args.vocabulary)})
+    diary = build_diary(args.entries, vocabulary, rng)
+
+    # 每条测试文本包含若干词表中的词语
+    texts = []
+    for _ in range(args.texts):
+        words = [rng.choice(vocabulary) for _ in range(3)] + [random_word(rng) for _ in range(20)]
+        rng.shuffle(words)
+        texts.append("，".join(words))
+
+    start = time.perf_counter()
+    index = EssenceIndex(diary)
+    index.match("")
+    build_ms = (time.perf_counter() - start) * 1000
+
+    # 两种实现的结果必须一致
+    for text in texts:
+        assert index.match(text) == match_essences_naive(diary, text)
+
+    naive_ms = time_calls(lambda text: match_essences_naive(diary, text), texts, args.repeat)
+    index_ms = time_calls(index.match, texts, args.repeat)
+
+    print(f"信息| 日记条数: {len(diary)} | 词表大小: {len(vocabulary)} | 测试文本: {len(texts)}条")
+    print(f"信息| 索引构建: {build_ms:.1f} 毫秒")
+    print(f"信息| 原始实现: {naive_ms:.3f} 毫秒/次")
+    print(f"信息| 索引实现: {index_ms:.3f} 毫秒/次 (加速 {naive_ms / index_ms:.0f}x)")
+
+def bench_semantic(args):
+    """语义检索：索引构建、磁盘加载和查询耗时"""
+    rng = random.Random(args.seed)
+    vocabulary = list({random_word(rng) for _ in range(args.vocabulary)})
+    diary = build_diary(args.entries, vocabulary, rng)
+    for entry in diary:
+        entry["content"] = "，".join(rng.choice(vocabulary) for _ in range(args.words))
+    texts = ["，".join(rng.choice(vocabulary) for _ in range(5)) for _ in range(args.texts)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "semantic_index.npz")
+
+        start = time.perf_counter()
+        index = SemanticIndex(path)
+        index.sync(diary)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        index.save()
+        save_ms = (time.perf_counter() - start) * 1000
+        size_mb = os.path.getsize(path) / 1024 / 1024
+
+        # 从磁盘加载的索引与内存中的索引结果必须一致
+        start = time.perf_counter()
+        loaded = SemanticIndex(path)
+        loaded.load()
+        loaded.sync(diary)
+        load_ms = (time.perf_counter() - start) * 1000
+        assert not loaded.dirty
+        for text in texts:
+            assert [date for date, _ in index.search(text, min_score=0)] == [date for date, _ in loaded.search(text, min_score=0)]
+
+        # 增量更新一天只重新计算一行
+        start = time.perf_counter()
+        diary[-1]["content"] += "，" + rng.choice(vocabulary)
+        index.upsert(diary[-1]["date"], SemanticIndex.entry_text(diary[-1]))
+        index.search(texts[0])
+        upsert_ms = (time.perf_counter() - start) * 1000
+
+        query_ms = time_calls(index.search, texts, args.repeat)
+
+    print(f"信息| 日记条数: {len(diary)} | 特征维度: {index.dimensions} | 测试文本: {len(texts)}条")
+    print(f"信息| 索引构建: {build_ms:.1f} 毫秒 | 写入磁盘: {save_ms:.1f} 毫秒 ({size_mb:.1f} MB) | 磁盘加载: {load_ms:.1f} 毫秒")
+    print(f"信息| 增量更新: {upsert_ms:.1f} 毫秒 | 查询: {query_ms:.3f} 毫秒/次")
+
+def bench_ranker(args):
+    """相关记忆排序：numpy与纯Python实现对比，同一种子结果必须一致"""
+    rng = random.Random(args.seed)
+    diary = build_diary(args.candidates, ["甲", "乙", "丙", "丁"], rng)
+    candidates = [
+        {"date": entry["date"], "match": rng.choice([0.5, 1.0, 1.5]), "rarity": rng.random(), "semantic": rng.random() * 0.3}
+        for entry in diary
+    ]
+
+    ranker = MemoryRanker(seed=args.seed)
+    ranker.record_usage([entry["date"] for entry in diary[-args.limit:]])
+    numpy_result = ranker.rank(candidates, args.limit)
+    assert numpy_result == ranker.rank(candidates, args.limit)
+    numpy_ms = time_calls(lambda _: ranker.rank(candidates, args.limit), [None], args.repeat)
+
+    # 暂时禁用numpy，使用纯Python实现
+    numpy_module = ATRI_Chat.NUMPY_MODULE
+    ATRI_Chat.NUMPY_MODULE = False
+    try:
+        assert ranker.rank(candidates, args.limit) == numpy_result
+        python_ms = time_calls(lambda _: ranker.rank(candidates, args.limit), [None], args.repeat)
+    finally:
+        ATRI_Chat.NUMPY_MODULE = numpy_module
+
+    print(f"信息| 候选条数: {len(candidates)} | 选择条数: {args.limit} | 种子: {args.seed}")
+    print(f"信息| 选择结果: {[candidate['date'] for candidate in numpy_result]}")
+    print(f"信息| numpy实现: {numpy_ms:.3f} 毫秒/次 | 纯Python实现: {python_ms:.3f} 毫秒/次")
+
+class FakeSpeechBackend:
+    """模拟翻译、TTS和播放耗时的后端"""
+    def __init__(self, delay):
+        self.delay = delay
+
+    def translate_sentences(self, sentences):
+        time.sleep(self.delay)
+        return list(sentences)
+
+    def synthesize_speech(self, text):
+        time.sleep(self.delay)
+        return text
+
+    def play_audio(self, audio, cancelled=None):
+        if cancelled is not None:
+            return not cancelled.wait(self.delay)
+        time.sleep(self.delay)
+        return True
+
+def bench_pipeline(args):
+    """语音流水线：输入结束后在不同时刻取消，各阶段线程都必须退出"""
+    backend_service = FakeSpeechBackend(args.delay)
+    cancel_ms = []
+    for i in range(args.repeat):
+        pipeline = SpeechPipeline(backend_service)
+        for j in range(args.sentences):
+            pipeline.feed(f"句子{j}")
+        pipeline.finish()
+        # 取消时刻覆盖结束标记位于各个阶段队列的情况
+        time.sleep(args.delay * args.sentences * i / args.repeat)
+
+        start = time.perf_counter()
+        pipeline.cancel()
+        waiter = threading.Thread(target=pipeline.wait, daemon=True)
+        waiter.start()
+        waiter.join(args.timeout)
+        assert not waiter.is_alive(), f"第{i + 1}次取消后流水线线程未退出"
+        cancel_ms.append((time.perf_counter() - start) * 1000)
+
+    print(f"信息| 句子数: {args.sentences} | 阶段耗时: {args.delay * 1000:.0f} 毫秒 | 取消次数: {args.repeat}")
+    print(f"信息| 取消到线程退出: 平均 {sum(cancel_ms) / len(cancel_ms):.1f} 毫秒 | 最长 {max(cancel_ms):.1f} 毫秒")
+
+def main():
+    parser = argparse.ArgumentParser(description="ATRI_Chat性能基准")
+    parser.add_argument("--seed", type=int, default=0)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    essence_parser = subparsers.add_parser("essence", help="Essence匹配：原始实现与索引对比")
+    essence_parser.add_argument("--entries", type=int, default=10000)
+    essence_parser.add_argument("--vocabulary", type=int, default=5000)
+    essence_parser.add_argument("--texts", type=int, default=50)
+    essence_parser.add_argument("--repeat", type=int, default=3)
+    essence_parser.set_defaults(func=bench_essence)
+
+    semantic_parser = subparsers.add_parser("semantic", help="语义检索：索引构建、磁盘加载和查询耗时")
+    semantic_parser.add_argument("--entries", type=int, default=10000)
+    semantic_parser.add_argument("--vocabulary", type=int, default=5000)
+    semantic_parser.add_argument("--words", type=int, default=40)
+    semantic_parser.add_argument("--texts", type=int, default=50)
+    semantic_parser.add_argument("--repeat", type=int, default=3)
+    semantic_parser.set_defaults(func=bench_semantic)
+
+    ranker_parser = subparsers.add_parser("ranker", help="相关记忆排序：numpy与纯Python实现对比")
+    ranker_parser.add_argument("--candidates", type=int, default=10000)
+    ranker_parser.add_argument("--limit", type=int, default=5)
+    ranker_parser.add_argument("--repeat", type=int, default=10)
+    ranker_parser.set_defaults(func=bench_ranker)
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="语音流水线：输入结束后取消，检查线程退出")
+    pipeline_parser.add_argument("--sentences", type=int, default=8)
+    pipeline_parser.add_argument("--delay", type=float, default=0.02)
+    pipeline_parser.add_argument("--repeat", type=int, default=20)
+    pipeline_parser.add_argument("--timeout", type=float, default=5.0)
+    pipeline_parser.set_defaults(func=bench_pipeline)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
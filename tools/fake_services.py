@@ -0,0 +1,350 @@
+"""本地替身服务：模拟ChatAI、火山翻译和GPT-SoVITS，用于离线测试和性能基准"""
+import io
+import json
+import math
+import random
+import struct
+import threading
+import time
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# 回复素材
+REPLY_ACTIONS = [
+    "（听到门把手拧动的声音，立刻从沙发上弹起来，呆毛一晃一晃地跑向玄关）",
+    "（双手叉腰，挺起小小的胸膛，红宝石般的眼睛闪闪发亮）",
+    "（歪着脑袋想了想，然后轻轻拉住你的衣角）",
+    "（把脸埋进你的手臂里蹭了蹭）",
+]
+REPLY_LINES = [
+    "欢迎回家~",
+    "我是高性能的嘛！",
+    "今天晚饭想吃螃蟹！",
+    "要一起坐坐嘛？",
+    "哼哼，这点小事难不倒我。",
+    "主人，你在想什么呢？",
+]
+REASONING_TEXT = "用户回来了，我应该表现得开心一点，同时想想今天发生了什么。"
+SUMMARY_JSON = {
+    "diary": [{"date": "", "content": "今天和主人一起度过了开心的一天。"}],
+    "promise": ["我们约定永远不分开"],
+    "preference": ["喜欢：喜欢吃辣"],
+    "plan": [{"date": "明天", "content": "和主人一起去买菜"}],
+    "motivation": ["想成为让主人骄傲的仿生人"],
+    "pivotal_memory": ["我愿意给主人膝枕"],
+}
+
+# TTS音频参数，与GPT-SoVITS默认输出一致
+SAMPLE_RATE = 32000
+CHANNELS = 1
+SAMPLE_WIDTH = 2
+
+def parse_distribution(spec):
+    """解析延迟分布，返回采样函数"""
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",")] if params else []
+
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda: max(random.gauss(values[0], values[1]), 0.0)
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"未知的延迟分布: {spec}")
+
+def wav_header(data_size, sample_rate=SAMPLE_RATE, channels=CHANNELS, sample_width=SAMPLE_WIDTH):
+    """构造WAV文件头，流式输出时数据长度未知，填写最大值"""
+    byte_rate = sample_rate * channels * sample_width
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", min(36 + data_size, 0xFFFFFFFF), b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, byte_rate, channels * sample_width, sample_width * 8,
+        b"data", min(data_size, 0xFFFFFFFF)
+    )
+
+def synthesize_pcm(duration):
+    """生成指定时长的PCM数据(低音量正弦波)"""
+    frame_count = int(duration * SAMPLE_RATE)
+    buffer = io.BytesIO()
+    for i in range(frame_count):
+        value = int(1200 * math.sin(2 * math.pi * 440 * i / SAMPLE_RATE))
+        buffer.write(struct.pack("<h", value))
+    return buffer.getvalue()
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    """替身服务请求处理基类"""
+    protocol_version = "HTTP/1.1"
+    options = None
+
+    def log_message(self, format, *args):
+        if self.options.verbose:
+            print(f"信息| {self.server.server_name_label} {format % args}")
+
+    def read_json(self):
+        """读取JSON请求体"""
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        return json.loads(body or b"{}")
+
+    def send_json(self, data, status=200):
+        """发送JSON响应"""
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def start_chunked(self, content_type):
+        """开始分块传输响应"""
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def write_chunk(self, data):
+        """写入一个分块"""
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def end_chunked(self):
+        """结束分块传输"""
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+class FakeChatAIHandler(FakeServiceHandler):
+    """模拟OpenAI兼容的ChatAI接口，支持流式输出和思维链"""
+    # 上一次请求的消息列表，用于模拟上下文缓存命中
+    last_messages = []
+    cache_lock = threading.Lock()
+
+    def do_POST(self):
+        if not urlparse(self.path).path.endswith("/chat/completions"):
+            self.send_json({"error": {"message": "not found"}}, 404)
+            return
+
+        request = self.read_json()
+        options = self.options
+
+        # 模拟首字延迟、偶发卡顿和错误
+        delay = options.llm_first_token()
+        if random.random() < options.llm_stall_rate:
+            delay += options.llm_stall_seconds
+        time.sleep(delay)
+        if random.random() < options.llm_error_rate:
+            self.send_json({"error": {"message": "模拟服务错误", "type": "server_error"}}, 500)
+            return
+
+        messages = request.get("messages", [])
+        usage = self.build_usage(messages)
+
+        # 总结请求返回JSON
+        if (request.get("response_format") or {}).get("type") == "json_object":
+            content = json.dumps(SUMMARY_JSON, ensure_ascii=False)
+            reasoning = ""
+        else:
+            content = self.build_reply(options.reply_chars)
+            reasoning = REASONING_TEXT if "reasoner" in request.get("model", "") else ""
+        usage["completion_tokens"] = int((len(content) + len(reasoning)) * 0.6)
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if request.get("stream"):
+            include_usage = (request.get("stream_options") or {}).get("include_usage", False)
+            self.stream_reply(request, content, reasoning, usage if include_usage else None)
+        else:
+            self.send_json({
+                "id": "fake-chatcmpl",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content, "reasoning_content": reasoning or None},
+                    "finish_reason": "stop"
+                }],
+                "usage": usage
+            })
+
+    def build_reply(self, reply_chars):
+        """按目标字数拼接回复"""
+        reply = ""
+        while len(reply) < reply_chars:
+            reply += random.choice(REPLY_ACTIONS) + random.choice(REPLY_LINES)
+        return reply
+
+    def build_usage(self, messages):
+        """估算Token用量，按与上一次请求相同的消息前缀模拟缓存命中"""
+        with self.cache_lock:
+            hit_chars = 0
+            for old, new in zip(FakeChatAIHandler.last_messages, messages):
+                if old != new:
+                    break
+                hit_chars += len(new.get("content", ""))
+            FakeChatAIHandler.last_messages = messages
+
+        total_chars = sum(len(msg.get("content", "")) for msg in messages)
+        prompt_tokens = int(total_chars * 0.6) + 4 * len(messages)
+        hit_tokens = min(int(hit_chars * 0.6) // 64 * 64, prompt_tokens)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "prompt_cache_hit_tokens": hit_tokens,
+            "prompt_cache_miss_tokens": prompt_tokens - hit_tokens,
+        }
+
+    def stream_reply(self, request, content, reasoning, usage):
+        """以SSE格式流式输出思维链和回复"""
+        self.start_chunked("text/event-stream")
+
+        def send_event(delta=None, finish_reason=None, usage_data=None):
+            chunk = {
+                "id": "fake-chatcmpl",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model"),
+                "choices": [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if usage_data is not None:
+                chunk["usage"] = usage_data
+            self.write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        step = self.options.chars_per_token
+        for i in range(0, len(reasoning), step):
+            send_event({"role": "assistant", "content": None, "reasoning_content": reasoning[i:i + step]})
+            time.sleep(self.options.token_interval)
+        for i in range(0, len(content), step):
+            send_event({"role": "assistant", "content": content[i:i + step]})
+            time.sleep(self.options.token_interval)
+        send_event({}, finish_reason="stop")
+        if usage is not None:
+            send_event(usage_data=usage)
+
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.end_chunked()
+
+class FakeTranslateHandler(FakeServiceHandler):
+    """模拟火山翻译TranslateText接口"""
+    def do_POST(self):
+        query = parse_qs(urlparse(self.path).query)
+        if query.get("Action", [""])[0] != "TranslateText":
+            self.send_json({"ResponseMetadata": {"Error": {"Code": "InvalidAction"}}}, 400)
+            return
+
+        request = self.read_json()
+        time.sleep(self.options.translate_latency())
+
+        # 译文以"訳:"标记，长度与原文相同
+        translations = [
+            {"Translation": f"訳:{text}", "DetectedSourceLanguage": request.get("SourceLanguage", "zh")}
+            for text in request.get("TextList", [])
+        ]
+        self.send_json({
+            "TranslationList": translations,
+            "ResponseMetadata": {"RequestId": "fake-translate", "Action": "TranslateText", "Version": "2020-06-01"}
+        })
+
+class FakeTTSHandler(FakeServiceHandler):
+    """模拟GPT-SoVITS的/tts接口，返回WAV音频，支持流式输出"""
+    def do_GET(self):
+        # 不带参数的请求返回400，与GPT-SoVITS一致，用于连通性检测
+        self.send_json({"message": "text is required"}, 400)
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/tts":
+            self.send_json({"message": "not found"}, 404)
+            return
+
+        request = self.read_json()
+        text = request.get("text", "")
+        if not text:
+            self.send_json({"message": "text is required"}, 400)
+            return
+
+        # 音频时长与文本长度成正比
+        duration = max(len(text) * self.options.seconds_per_char, 0.2)
+        pcm = synthesize_pcm(duration)
+        time.sleep(self.options.tts_first_chunk())
+
+        if not request.get("streaming_mode"):
+            # 非流式：模拟完整合成耗时后返回整个文件
+            time.sleep(duration * self.options.tts_realtime_factor)
+            body = wav_header(len(pcm)) + pcm
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/wav")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        # 流式：先发送数据长度未知的WAV头，再按合成速度发送PCM分块
+        self.start_chunked("audio/wav")
+        self.write_chunk(wav_header(0xFFFFFFFF - 36))
+        chunk_size = int(SAMPLE_RATE * SAMPLE_WIDTH * CHANNELS * self.options.tts_chunk_seconds)
+        for i in range(0, len(pcm), chunk_size):
+            self.write_chunk(pcm[i:i + chunk_size])
+            time.sleep(self.options.tts_chunk_seconds * self.options.tts_realtime_factor)
+        self.end_chunked()
+
+def start_server(handler_class, port, label, options):
+    """在后台线程中启动替身服务"""
+    handler = type(handler_class.__name__, (handler_class,), {"options": options})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.server_name_label = label
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"信息| {label}替身服务已启动: http://127.0.0.1:{port}")
+    return server
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(
+        description="ATRI_Chat本地替身服务",
+        epilog="延迟分布格式：fixed:秒 | uniform:最小,最大 | normal:均值,标准差 | lognormal:中位数,sigma"
+    )
+    parser.add_argument("--chatai-port", type=int, default=9890)
+    parser.add_argument("--translate-port", type=int, default=9891)
+    parser.add_argument("--tts-port", type=int, default=9880)
+
+    # ChatAI
+    parser.add_argument("--llm-first-token", type=parse_distribution, default="lognormal:0.8,0.4", help="首字延迟分布")
+    parser.add_argument("--llm-stall-rate", type=float, default=0.0, help="偶发卡顿概率")
+    parser.add_argument("--llm-stall-seconds", type=float, default=40.0, help="卡顿时额外等待的秒数")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="返回500错误的概率")
+    parser.add_argument("--reply-chars", type=int, default=100, help="回复字数")
+    parser.add_argument("--token-interval", type=float, default=0.03, help="流式输出间隔(秒)")
+    parser.add_argument("--chars-per-token", type=int, default=2, help="每个流式分块的字数")
+
+    # 翻译
+    parser.add_argument("--translate-latency", type=parse_distribution, default="lognormal:0.3,0.3", help="翻译延迟分布")
+
+    # TTS
+    parser.add_argument("--tts-first-chunk", type=parse_distribution, default="lognormal:0.3,0.3", help="TTS首个分块延迟分布")
+    parser.add_argument("--seconds-per-char", type=float, default=0.2, help="每个字的音频时长(秒)")
+    parser.add_argument("--tts-realtime-factor", type=float, default=0.3, help="合成耗时与音频时长之比")
+    parser.add_argument("--tts-chunk-seconds", type=float, default=0.25, help="流式输出的每个分块时长(秒)")
+
+    parser.add_argument("--verbose", action="store_true", help="打印请求日志")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    options = parse_args(argv)
+    start_server(FakeChatAIHandler, options.chatai_port, "ChatAI", options)
+    start_server(FakeTranslateHandler, options.translate_port, "火山翻译", options)
+    start_server(FakeTTSHandler, options.tts_port, "GPT-SoVITS", options)
+
+    print("信息| 启动ATRI_Chat前设置以下环境变量：")
+    print(f"      ATRI_DEEPSEEK_BASE_URL=http://127.0.0.1:{options.chatai_port}")
+    print(f"      ATRI_TRANSLATE_HOST=127.0.0.1:{options.translate_port}")
+    print(f"      ATRI_TTS_API_URL=http://127.0.0.1:{options.tts_port}/tts")
+    print("      CHATAI_API_KEY=fake VOLC_ACCESS_KEY=fake VOLC_SECRET_KEY=fake")
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("信息| 替身服务已停止")
+
+if __name__ == "__main__":
+    main()